@@ -1,3 +1,11 @@
-from .enumerate import enumerate_coefficients, exact_coefficients, exact, \
-    extract_coefficients_algebraically, algebraic_form, evaluate_expression, generating_function, check_on_oeis
-from .nfa import disambiguate, print_regex, compile_disambiguously, reduce
\ No newline at end of file
+from .version import __version__
+from .enumerate import enumerate_coefficients, exact_coefficients, exact, exact_many, \
+    extract_coefficients_algebraically, algebraic_form, evaluate_expression, generating_function, check_on_oeis, \
+    dfa_coefficients, is_unambiguous, evaluate_many
+from .nfa import disambiguate, print_regex, compile_disambiguously, reduce, minimize
+from .compiled import compile, Compiled, cache_info, cache_clear
+from .parse import RegexSyntaxError
+from .transfer import generating_function_from_dfa
+from .batch import enumerate_batch, BatchResult
+from .profiling import profile, Report
+from .series import coefficients_array
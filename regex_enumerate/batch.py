@@ -0,0 +1,124 @@
+import multiprocessing
+import signal
+from collections import namedtuple
+from itertools import islice
+
+from regex_enumerate.enumerate import exact_many, evaluate_many, dfa_coefficients
+
+# The outcome for the regex at position index of the batch: either its value, or the error that it raised.
+BatchResult = namedtuple('BatchResult', ['index', 'regex', 'value', 'error'])
+
+
+def dfa_many(regex, ns, what = None, safe = False):
+    # The walk counts every letter of a word, so there is no way to only count the letters in what.
+    if what is not None:
+        raise ValueError("The 'dfa' method counts every letter, and does not support what.")
+    counts = list(dfa_coefficients(regex, max(ns) if ns else -1))
+    return [counts[n] for n in ns]
+
+
+def evaluate_list(regex, ns, what = None, safe = False):
+    return [float(value) for value in evaluate_many(regex, ns, what, safe = safe)]
+
+
+methods = {
+    'exact': exact_many,
+    'dfa': dfa_many,
+    'evaluate': evaluate_list,
+}
+
+# The parameters that every task of the batch in this process shares, set up once per worker.
+job = None
+
+
+def initialize(method, ns, what, safe, timeout):
+    '''
+    Sets up the job of this process.
+    :return: the SIGALRM handler that this replaced, if any
+    '''
+    global job
+    job = (methods.get(method, method), list(ns), what, safe, timeout)
+    if timeout and hasattr(signal, 'setitimer'):
+        return signal.signal(signal.SIGALRM, expire)
+
+
+def expire(signum, frame):
+    raise TimeoutError('timed out')
+
+
+def run(task):
+    '''
+    Enumerates a single regex of the batch, so that a failure (or a timeout) only affects its own result.
+    '''
+    index, regex = task
+    method, ns, what, safe, timeout = job
+    alarm = timeout and hasattr(signal, 'setitimer')
+    try:
+        if alarm: signal.setitimer(signal.ITIMER_REAL, timeout)
+        return BatchResult(index, regex, method(regex, ns, what, safe = safe), None)
+    except Exception as e:
+        return BatchResult(index, regex, None, '%s: %s' % (type(e).__name__, e))
+    finally:
+        if alarm: signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def enumerate_batch(regexes, ns, method = 'exact', what = None, safe = False, processes = None,
+                    chunksize = None, timeout = None, ordered = True):
+    '''
+    Enumerates a whole corpus of regexes over a pool of worker processes. Workers are started once for the
+    whole batch, so they keep their imports and their caches (see compile) warm from one regex to the next.
+    :param ns: the sizes to count the words of, for every regex
+    :param method: 'exact' (exact_many), 'dfa' (counting through the DFA), 'evaluate' (evaluate_many), or any
+                   picklable function(regex, ns, what, safe = safe)
+    :param what: the letters that contribute to the count, as in exact, which 'dfa' does not support
+    :param processes: the number of worker processes, where 1 runs everything in this process
+    :param chunksize: the number of regexes sent to a worker at a time
+    :param timeout: the number of seconds after which a single regex is abandoned (where SIGALRM is available)
+    :param ordered: stream the results back in the order of regexes, rather than as soon as they complete
+    :return: a generator of BatchResult, one for each regex
+    '''
+    if methods.get(method) is dfa_many and what is not None:
+        raise ValueError("The 'dfa' method counts every letter, and does not support what.")
+    tasks = enumerate(regexes)
+    arguments = (method, ns, what, safe, timeout)
+    if processes == 1:
+        def inline():
+            # Everything runs in this process, so hand SIGALRM back to whoever had it once the batch is done.
+            previous = initialize(*arguments)
+            try:
+                for task in tasks:
+                    yield run(task)
+            finally:
+                if previous is not None: signal.signal(signal.SIGALRM, previous)
+
+        return inline()
+    if chunksize is None:
+        # Several chunks per worker keep the load balanced, while large enough ones amortize the overhead.
+        size = len(regexes) if hasattr(regexes, '__len__') else 1024
+        chunksize = max(1, min(64, size // (4 * (processes or multiprocessing.cpu_count()))))
+
+    def results():
+        pool = multiprocessing.Pool(processes, initializer=initialize, initargs=arguments)
+        try:
+            imap = pool.imap if ordered else pool.imap_unordered
+            for result in imap(run, tasks, chunksize):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    return results()
+
+
+if __name__ == '__main__':
+    import time
+
+    corpus = ['(%s|%s)*%s' % (bin(j)[2:], bin(j // 3)[2:], '1' * (j % 5)) for j in range(2000)]
+    corpus += ['(', '*0'] # failures are isolated
+    for processes in [1, None]:
+        start = time.time()
+        results = list(enumerate_batch(corpus, [10, 100, 1000], processes=processes, timeout=5))
+        print('%4s processes: %d regexes in %.2fs, %d failed, e.g. %s' % (
+            processes or 'all', len(results), time.time() - start,
+            sum(1 for result in results if result.error), list(islice((r for r in results if r.error), 1))))
@@ -0,0 +1,186 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from itertools import islice
+
+from regex_enumerate import constants
+from regex_enumerate.compiled import cache_clear
+from regex_enumerate.enumerate import exact, exact_coefficients, extract_coefficients_algebraically, algebraic_form, \
+    matrix_method
+from regex_enumerate.nfa import determinize, reconstruct, disambiguate
+from regex_enumerate.nfa import compile as thompson
+from regex_enumerate.parse import parse
+from regex_enumerate.series import coefficients_array
+from regex_enumerate.transfer import transfer, rationalize, simplify
+from regex_enumerate.version import __version__
+
+# The parameterized families of regexes, each as a function of its size k, along with the sizes to run.
+families = {
+    # ((01)*1)*1 for k = 2
+    'nested stars': (lambda k: '(' * k + '01' + ')*1' * k, [1, 2, 4, 8, 16]),
+    # (0|10|110)* for k = 3
+    'alternation': (lambda k: '(%s)*' % '|'.join('1' * j + '0' for j in range(k)), [2, 4, 8, 16, 32]),
+    # the ways of making change for n out of coins of denominations 1, 2, ..., k
+    'coin change': (lambda k: ''.join('(%s)*' % ('.' * j) for j in range(1, k + 1)), [2, 4, 6, 8, 10]),
+    # the compositions of n into k parts
+    'concatenation': (lambda k: '01*' * k, [2, 4, 8, 16, 32]),
+}
+
+
+def fresh(regex):
+    # Time the stage from scratch, without the compiled regexes or the constants that earlier runs left behind.
+    cache_clear()
+    constants.clear()
+    return regex
+
+
+# Each stage is (setup, run): setup(regex) prepares the inputs of the stage outside of the timed region, and
+# run(inputs) is the stage itself.
+stages = {
+    'parse': (lambda regex: regex, parse),
+    'transfer': (parse, transfer),
+    'rationalize': (lambda regex: transfer(parse(regex)), rationalize),
+    'simplify': (lambda regex: rationalize(transfer(parse(regex))), lambda rational: simplify(*rational)),
+    'exact': (fresh, lambda regex: exact(regex, 100)),
+    'exact_coefficients': (fresh, lambda regex: list(islice(exact_coefficients(regex), 100))),
+    'coefficients_array': (fresh, lambda regex: coefficients_array(regex, 10 ** 5, modulus=998244353)),
+    'extract_coefficients_algebraically': (fresh, extract_coefficients_algebraically),
+    'algebraic_form': (fresh, algebraic_form),
+    'determinize': (lambda regex: thompson(parse(regex)), determinize),
+    'reconstruct': (lambda regex: determinize(thompson(parse(regex))), lambda dfa: reconstruct(*dfa)),
+    'disambiguate': (lambda regex: regex, disambiguate),
+    'matrix_method': (fresh, matrix_method),
+}
+
+
+def measure(setup, run, regex, repeat, memory = True):
+    '''
+    Times run(setup(regex)) repeat times, and then traces its peak memory in one more run (since tracing slows
+    everything down, it is kept out of the timed runs).
+    :return: (the fastest time in seconds, the peak memory allocated in bytes, or None if memory is not set)
+    '''
+    times = []
+    for _ in range(repeat):
+        inputs = setup(regex)
+        start = time.perf_counter()
+        run(inputs)
+        times.append(time.perf_counter() - start)
+    if not memory:
+        return min(times), None
+    inputs = setup(regex)
+    tracemalloc.start()
+    try:
+        run(inputs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names = None, families = families, repeat = 3, budget = 5.0, memory = True, log = None):
+    '''
+    Runs every stage in names (or all of them) over every family of regexes, in increasing sizes. Once a stage
+    takes longer than budget seconds on a family, its larger sizes are skipped.
+    :param memory: whether to also measure the peak memory of every stage, which takes a much slower traced run
+    :param log: a function that is called with every result as soon as it is measured, e.g. to print progress
+    :return: the results, along with the environment they were measured in, as a JSON-serializable dict
+    '''
+    results = []
+    for family, (generate, sizes) in sorted(families.items()):
+        for stage in names or sorted(stages):
+            setup, run = stages[stage]
+            skipped = False
+            for k in sizes:
+                regex = generate(k)
+                result = {'family': family, 'k': k, 'regex': regex, 'stage': stage}
+                if skipped:
+                    result['skipped'] = True
+                else:
+                    try:
+                        result['seconds'], result['peak_bytes'] = measure(setup, run, regex, repeat, memory)
+                        skipped = result['seconds'] > budget
+                    except Exception as e:
+                        result['error'] = '%s: %s' % (type(e).__name__, e)
+                results.append(result)
+                if log: log(result)
+    return {
+        'version': __version__,
+        'commit': commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(baseline, current, tolerance = 1.25, noise = None):
+    '''
+    Compares two runs of the suite.
+    :param noise: the smallest growth of each metric that counts, so that timer jitter on fast stages does not
+                  get reported as a regression (by default, a millisecond and 4KB)
+    :return: the list of (family, k, stage, metric, before, after) for every time or peak memory that grew by more
+             than a factor of tolerance
+    '''
+    if noise is None: noise = {'seconds': 1e-3, 'peak_bytes': 1 << 12}
+    before = dict(((r['family'], r['k'], r['stage']), r) for r in baseline['results'])
+    regressions = []
+    for r in current['results']:
+        old = before.get((r['family'], r['k'], r['stage']))
+        if not old: continue
+        for metric in ('seconds', 'peak_bytes'):
+            if old.get(metric) is None or r.get(metric) is None: continue
+            if r[metric] > tolerance * old[metric] and r[metric] - old[metric] > noise[metric]:
+                regressions.append((r['family'], r['k'], r['stage'], metric, old[metric], r[metric]))
+    return regressions
+
+
+def describe(result):
+    if 'seconds' in result:
+        outcome = '%10.4fs' % result['seconds']
+        if result['peak_bytes'] is not None: outcome += ' %10.1fKB' % (result['peak_bytes'] / 1024.0)
+    else:
+        outcome = 'skipped' if result.get('skipped') else result['error']
+    return '%-14s k=%-3d %-36s %s' % (result['family'], result['k'], result['stage'], outcome)
+
+
+if __name__ == '__main__':
+    # python -m regex_enumerate.benchmark [--output results.json] [--compare baseline.json] [stage ...]
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmarks every stage of the pipeline over families of regexes.')
+    parser.add_argument('stages', nargs='*',
+                        help='the stages to run, out of %s (default: all)' % ', '.join(sorted(stages)))
+    parser.add_argument('--output', help='where to save the results, as JSON')
+    parser.add_argument('--compare', help='the saved results of an earlier run to check for regressions against')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--budget', type=float, default=5.0)
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='only measure time')
+    arguments = parser.parse_args()
+    unknown = set(arguments.stages) - set(stages)
+    if unknown: parser.error('unknown stages: %s' % ', '.join(sorted(unknown)))
+
+    report = run_suite(arguments.stages, repeat=arguments.repeat, budget=arguments.budget, memory=arguments.memory,
+                       log=lambda result: print(describe(result)))
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            regressions = compare(json.load(f), report, arguments.tolerance)
+        for (family, k, stage, metric, before, after) in regressions:
+            print('Regressed: %-14s k=%-3d %-36s %s %.4g -> %.4g' % (family, k, stage, metric, before, after))
+        if regressions: sys.exit(1)
@@ -0,0 +1,194 @@
+import hashlib
+import threading
+
+from regex_enumerate import persistent, profiling
+from regex_enumerate.memoize import LRUCache
+from regex_enumerate.nfa import NFA, determinize, minimize, ambiguous
+from regex_enumerate.nfa import compile as thompson
+from regex_enumerate.parse import parse
+from regex_enumerate.transfer import transfer, rationalize, simplify, generating_function_from_dfa, Polynomial
+
+
+class Compiled(object):
+    '''
+    A regular expression along with everything that the library has derived from it so far.
+    Each stage of the pipeline (the regex tree, the rational form, the automata, the roots and
+    partial fractions, ...) is computed on first use and then kept around, so that asking many
+    questions about the same regex only pays for the pipeline once.
+    '''
+    def __init__(self, regex, what = None):
+        self.regex = regex
+        self.what = what
+        self.stages = {}
+        # Held while computing a stage, so that threads sharing this object (through the cache of compile)
+        # compute each stage only once. Reentrant, since stages are computed out of earlier stages.
+        self.lock = threading.RLock()
+        # A rough measure of how much memory this object holds onto, in number of stored terms.
+        self.weight = len(regex) if isinstance(regex, str) else 1
+
+    def stage(self, key, compute):
+        '''
+        Returns the memoized result of compute(), computing it on first use.
+        '''
+        if key not in self.stages:
+            with self.lock:
+                if key not in self.stages:
+                    profiling.count('stage misses')
+                    value = compute()
+                    self.weight += weigh(value)
+                    self.stages[key] = value
+                    return value
+        profiling.count('stage hits')
+        return self.stages[key]
+
+    @property
+    def ast(self):
+        return self.stage('ast', lambda: parse(self.regex) if isinstance(self.regex, str) else self.regex)
+
+    @property
+    def rational(self):
+        '''
+        overflow(z) + top(z)/bottom(z), where the quotient is irreducible.
+        '''
+        return self.stage('rational', lambda: persisted(
+            self, 'rational', lambda: simplify(*rationalize(transfer(self.ast, self.what)))))
+
+    @property
+    def nfa(self):
+        return self.stage('nfa', lambda: thompson(self.ast))
+
+    @property
+    def dfa(self):
+        return self.stage('dfa', lambda: determinize(self.nfa))
+
+    @property
+    def minimal_dfa(self):
+        return self.stage('minimal_dfa', lambda: minimize(self.dfa))
+
+    @property
+    def ambiguous(self):
+        '''
+        Whether the rational form counts some words more than once, i.e. some word has several parses.
+        '''
+        return self.stage('ambiguous', lambda: ambiguous(self.nfa))
+
+    @property
+    def unambiguous(self):
+        '''
+        A sibling of this object whose rational form is read off of the minimal DFA rather than the
+        regex, so that it counts every word exactly once, however ambiguous the regex is.
+        '''
+        def derive():
+            sibling = Compiled(self.regex, self.what)
+            for key in ('ast', 'nfa', 'dfa', 'minimal_dfa'):
+                if key in self.stages: sibling.stages[key] = self.stages[key]
+            sibling.stage('rational', lambda: persisted(
+                sibling, 'dfa', lambda: generating_function_from_dfa(self.minimal_dfa, self.what)))
+            sibling.stages['ambiguous'] = False
+            return sibling
+        return self.stage('unambiguous', derive)
+
+    @property
+    def roots(self):
+        '''
+        The roots of the denominator of the rational form, along with their multiplicities.
+        '''
+        return self.partial_fractions[0]
+
+    @property
+    def partial_fractions(self):
+        '''
+        (clusters, basis, partial_coefficients, polynomial, rational) from the partial fraction decomposition.
+        '''
+        from regex_enumerate.enumerate import extract_coefficients_algebraically
+        return extract_coefficients_algebraically(self)[1]
+
+    def __repr__(self):
+        return 'Compiled(%r, what=%r)' % (self.regex, self.what)
+
+
+def weigh(value, seen = None):
+    # Regex trees may be DAGs, so every object is only counted once.
+    if seen is None: seen = set()
+    if id(value) in seen: return 0
+    seen.add(id(value))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return 1 + sum(weigh(sub, seen) for sub in value)
+    if isinstance(value, dict):
+        return 1 + sum(weigh(sub, seen) for sub in value.values())
+    if hasattr(value, 'coefficients'):
+        return 1 + len(value.coefficients)
+    if isinstance(value, NFA):
+        return 1 + len(value)
+    if isinstance(value, Compiled):
+        return value.weight
+    return getattr(value, 'size', 1)
+
+
+def fingerprint(ast, memo = None):
+    '''
+    A structural digest of a regex tree, computed once per node so that regex DAGs with
+    heavily shared subexpressions are fingerprinted in time linear in their number of nodes.
+    '''
+    if memo is None: memo = {}
+    if id(ast) not in memo:
+        t, data = ast
+        if t in ('|', '.'):
+            body = ','.join(fingerprint(sub, memo) for sub in data)
+        elif t == '*':
+            body = fingerprint(data, memo)
+        else:
+            body = repr(data)
+        memo[id(ast)] = (ast, hashlib.sha1(('%s(%s)' % (t, body)).encode('utf-8')).hexdigest())
+    return memo[id(ast)][1]
+
+
+def persisted(compiled, kind, compute):
+    '''
+    The rational form compute() of compiled, going through the on-disk cache (see persistent) when there is one,
+    where it is addressed by the fingerprint of the regex tree, the letters in what, and the kind of derivation.
+    '''
+    if not persistent.directory:
+        return compute()
+
+    def flatten():
+        overflow, (top, bottom) = compute()
+        return {'overflow': overflow.coefficients, 'top': top.coefficients, 'bottom': bottom.coefficients}
+    what = sorted(compiled.what) if compiled.what else None
+    fields = persistent.fetch(persistent.key(kind, fingerprint(compiled.ast), what), flatten)
+    return Polynomial(fields['overflow']), (Polynomial(fields['top']), Polynomial(fields['bottom']))
+
+
+def normalize(regex, what = None):
+    regex = regex.replace(' ', '') if isinstance(regex, str) else fingerprint(regex)
+    return regex, frozenset(what) if what else None
+
+
+cache = LRUCache(maxsize = 512, maxweight = 1 << 22, weigh = lambda compiled: compiled.weight)
+
+
+def compile(regex, what = None):
+    '''
+    Compiles a regular expression (either as a string or as a regex tree) into a Compiled object,
+    which every public function in this library also accepts in place of the regex itself.
+    Compiled objects are shared through a bounded LRU cache keyed by the normalized regex and
+    the letters in what, so repeated questions about the same regex reuse all prior work.
+    '''
+    if isinstance(regex, Compiled):
+        if what is None or normalize('', what) == normalize('', regex.what): return regex
+        regex = regex.regex
+    key = normalize(regex, what)
+    compiled = cache.get(key)
+    profiling.count('compile cache misses' if compiled is None else 'compile cache hits')
+    if compiled is None:
+        compiled = Compiled(regex, what)
+        cache.put(key, compiled)
+    return compiled
+
+
+def cache_info():
+    return cache.info()
+
+
+def cache_clear():
+    cache.clear()
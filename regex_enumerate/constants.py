@@ -0,0 +1,156 @@
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from regex_enumerate import profiling
+from regex_enumerate.memoize import LRUCache
+from regex_enumerate.profiling import timed
+
+# A memo of mpmath.identify, keyed by (rounded value, tol, maxcoeff). The same few constants (roots of unity,
+# the golden ratio, sqrt(2), ...) show up in the closed forms of most regexes, and mpmath.identify is one of the
+# slowest steps of algebraic_form. It is bounded, so that long-running processes do not grow without limit.
+memo = LRUCache(maxsize = 1 << 16)
+# Tells entries that are memoized as None (constants that could not be identified) apart from missing ones.
+absent = object()
+# The path of the optional on-disk store that the memo is loaded from and saved back into.
+store = None
+# Whether the memo holds entries that are not in the store yet.
+dirty = False
+# Only farm the identification out to a process pool when there are at least this many new constants.
+parallel_threshold = 32
+
+
+def key(value, tol, maxcoeff):
+    # Round relative to the value, so that values that only differ in roundoff share their entry.
+    return '%.12g|%r|%r' % (value, tol, maxcoeff)
+
+
+def identify_one(arguments):
+    import mpmath
+    value, tol, maxcoeff = arguments
+    return mpmath.identify(value, tol=tol, maxcoeff=maxcoeff)
+
+
+def identify(value, tol, maxcoeff):
+    '''
+    mpmath.identify(value, tol=tol, maxcoeff=maxcoeff), memoized.
+    '''
+    return identify_many([value], tol, maxcoeff)[0]
+
+
+@timed('identify')
+def identify_many(values, tol, maxcoeff, processes = None):
+    '''
+    Identifies every value in values (as in identify), and identifies the ones that are not memoized yet in
+    parallel over a process pool when there are many of them.
+    :param processes: the size of the process pool, where 1 never starts one, and None lets multiprocessing decide.
+                      No pool is started from within a daemonic worker (e.g. of enumerate_batch) either, since
+                      those are not allowed to have children.
+    :return: the list of identified constants (or None), in the same order as values
+    '''
+    values = [float(value) for value in values]
+    keys = [key(value, tol, maxcoeff) for value in values]
+    # Hold on to the entries of this call, even if the memo evicts them before it returns.
+    found = {}
+    for k in set(keys):
+        entry = memo.get(k, absent)
+        if entry is not absent: found[k] = entry
+    missing = sorted(set(keys) - set(found))
+    profiling.count('identify hits', len(values) - len(missing))
+    profiling.count('identify misses', len(missing))
+    if missing:
+        arguments = dict((key(value, tol, maxcoeff), (value, tol, maxcoeff)) for value in values)
+        tasks = [arguments[k] for k in missing]
+        import multiprocessing
+        if len(tasks) >= parallel_threshold and processes != 1 and not multiprocessing.current_process().daemon:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(identify_one, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [identify_one(task) for task in tasks]
+        for k, result in zip(missing, results):
+            memo.put(k, result)
+            found[k] = result
+        mark()
+        flush()
+    return [found[k] for k in keys]
+
+
+def remember(key, compute):
+    '''
+    Memoizes any other (JSON-serializable) value derived from a constant under key, e.g. a symbolic form.
+    '''
+    value = memo.get(key, absent)
+    if value is absent:
+        profiling.count('symbolic misses')
+        value = compute()
+        memo.put(key, value)
+        mark()
+    else:
+        profiling.count('symbolic hits')
+    return value
+
+
+def mark():
+    global dirty
+    dirty = True
+
+
+def flush():
+    '''
+    Saves the new entries of the memo into the store, if there is one.
+    '''
+    global dirty
+    if store and dirty:
+        save()
+        dirty = False
+
+
+def load(path):
+    '''
+    Uses path as the on-disk store of the memo: loads whatever it already holds, and saves every new constant
+    back into it from then on.
+    '''
+    global store
+    store = path
+    if os.path.exists(path):
+        with open(path) as f:
+            for k, value in json.load(f).items():
+                memo.put(k, value)
+
+
+def save():
+    # Merge with whatever other processes saved in the meantime, and then atomically replace the store. The merge
+    # holds an exclusive lock on store.lock (where fcntl is available), so that concurrent saves do not drop each
+    # other's new constants.
+    with open(store + '.lock', 'a') as lock:
+        if fcntl: fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            entries = {}
+            if os.path.exists(store):
+                with open(store) as f:
+                    entries = json.load(f)
+            entries.update(memo.items())
+            directory = os.path.dirname(os.path.abspath(store))
+            handle, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(handle, 'w') as f:
+                json.dump(entries, f)
+            os.replace(path, store)
+        finally:
+            if fcntl: fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def clear():
+    memo.clear()
+
+
+if os.environ.get('REGEX_ENUMERATE_CONSTANTS'):
+    load(os.environ['REGEX_ENUMERATE_CONSTANTS'])
@@ -1,70 +1,204 @@
-from collections import defaultdict
+from collections import defaultdict, deque
+from fractions import Fraction
 
+import cmath
 import itertools
-import mpmath
-from numpy import array, zeros, eye, dot
-from numpy.linalg import solve, norm, eigvals, matrix_power, det
-from numpy.polynomial import Polynomial as P
-from scipy.special import comb
-from sympy import nsimplify, sympify, binomial, DiracDelta
+import math
+import os
+import threading
 
-from regex_enumerate.nfa import determinize, reconstruct, compile
-from regex_enumerate.parse import parse
-from regex_enumerate.transfer import transfer, rationalize, simplify, process, down_p, mul, leading_term
+from regex_enumerate.compiled import compile
+from regex_enumerate import constants, persistent
+from regex_enumerate.constants import identify, identify_many
+from regex_enumerate.nfa import reconstruct
+from regex_enumerate.profiling import timed
+from regex_enumerate.transfer import Polynomial, process, factor, derivative, ratio, rational
 
 from itertools import islice
 
 
-def exact(regex, n, what = None, use_overflow = True):
+def is_unambiguous(regex):
+    '''
+    Checks whether every word in the language of regex has exactly one parse, in which case the rational form
+    counts words rather than parses. This takes polynomial time (see nfa.ambiguous), which is far less than
+    counting through the DFA.
+    '''
+    return not compile(regex).ambiguous
+
+
+def counted(regex, what = None, safe = False):
+    '''
+    compile(regex, what), unless safe is set and the regex is ambiguous, in which case its unambiguous form.
+    '''
+    compiled = compile(regex, what)
+    return compiled.unambiguous if safe and compiled.ambiguous else compiled
+
+
+def exact(regex, n, what = None, use_overflow = True, safe = False):
     '''
     Compute an exact enumeration for the number of words of length n in the language
     given by the regular expression. You can provide an optional set of letters
     within your alphabet that contribute to the count.
+    :param safe: count words rather than parses, even if the regex is ambiguous. This is the case in the
+                 public functions below as well.
     :return: Number of words of size n in regex.
     '''
-    ast = transfer(regex, what)
-    # p(z)/q(z) = overflow(x) + top(z)/bottom(z) where each is a polynomial and the quotient is irreducible.
-    overflow, (top, bottom) = simplify(*rationalize(ast))
+    return exact_many(regex, [n], what, use_overflow, safe)[0]
+
 
+@timed('exact')
+def exact_many(regex, ns, what = None, use_overflow = True, safe = False):
+    '''
+    Computes exact(regex, n) for every n in ns, sharing a single rational form and a single
+    table of repeated squarings across the whole batch. Each query costs O(deg^2 log n), so
+    n can comfortably range into the billions.
+    :return: list of the number of words of size n in regex, in the same order as ns
+    '''
+    # p(z)/q(z) = overflow(x) + top(z)/bottom(z) where each is a polynomial and the quotient is irreducible.
+    compiled = counted(regex, what, safe)
+    overflow, top, recurrence = linear_recurrence(compiled)
+    # The squarings are kept on the compiled regex, so later batches reuse them as well.
+    jump = compiled.stage('jumper', lambda: jumper(top, recurrence))
     # Generally, the overflow is some low-order polynomial that gives no contribution asymptotically.
     # Tick this if you are computing the boundary values for the algebraic enumeration.
-    if not use_overflow: overflow = {}
-    # Normalize the numerator if it is zero.
-    top = process(top)
-    if not top:
-        return overflow[n] if n in overflow else 0
-
-    # Dynamic program for coefficient extraction.
-    # In essence, we draw inspiration from Matrix Computations' use of Krylov Methods.
-    #     p(z)/(1 - q(z)) -> p(z) + pq + pq^2 + pq^3 + ...
-    # which lets us invert a polynomial using only polynomial multiplications.
-    assert bottom[0]
-    # Normalize into the p(z)/(1 - q(z)) form
-    _, p = down_p(('*', [('v', top), ('v', {0 : 1/bottom[0]})]))     # p = top(z)/bottom(0)
-    _, q = down_p(('*', [('v', bottom), ('v', {0 : -1/bottom[0]})])) # q = -bottom(z)/bottom(0)
-    q.pop(0) # get rid of the +/-1 in q(z), effectively q(z) - 1.
-
-    qn = p # tracks p(z) * q(z)**n
-    coefficients = overflow[n] if n in overflow else 0 # overflow contributes at a finite scale
-    for i in range(n + 1):
-        coefficients += qn[n] if n in qn else 0
-        # update p*q**n to p*q**(n + 1)
-        _, qn = mul(('v', qn), ('v', q))
-
-    return coefficients if not use_overflow else int(round(coefficients))
-
-
-def exact_coefficients(regex, what = None, use_overflow = True):
+    if not use_overflow:
+        return [jump(n) for n in ns]
+    return [int(round(jump(n) + overflow.get(n, 0))) for n in ns]
+
+
+def integral(p):
+    '''
+    Snaps the coefficients of a polynomial onto the integers whenever they are within roundoff
+    of one, so that the recurrences below can be stepped through in exact integer arithmetic.
+    Exact (Fraction) coefficients have no roundoff, so they are only snapped when they are integers.
+    '''
+    snap = lambda v: v == round(v) if isinstance(v, Fraction) else abs(v - round(v)) < 1e-6
+    return {k: int(round(v)) if snap(v) else v for k, v in p.items()}
+
+
+def linear_recurrence(regex, what = None):
+    '''
+    Derives the linear recurrence satisfied by the coefficients of the generating function.
+    Since top(z)/bottom(z) = sum a[n] z**n, multiplying through by bottom(z) and normalizing
+    bottom(0) = 1 gives
+        a[n] = top[n] + c[1] a[n - 1] + c[2] a[n - 2] + ... + c[d] a[n - d]
+    where c[k] = -bottom[k]/bottom[0].
+    :return: overflow, top, and the list of recurrence coefficients [c[1], ..., c[d]]
+    '''
+    compiled = compile(regex, what)
+
+    def derive():
+        overflow, (top, bottom) = compiled.rational
+        top = process(top)
+        if not top:
+            return integral(overflow), {}, []
+        assert bottom[0]
+        # Exact coefficients stay exact, so that the recurrence can be stepped without any roundoff.
+        unit = ratio(1, bottom[0]) if rational(bottom) else 1 / bottom[0]
+        top = integral(top.scale(unit))
+        recurrence = integral(bottom.scale(-unit))
+        return integral(overflow), top, [recurrence.get(k, 0) for k in range(1, bottom.degree + 1)]
+
+    return compiled.stage('recurrence', derive)
+
+
+def step(top, recurrence, start = 0, jump = None):
+    '''
+    Steps the sequence a[start], a[start + 1], ... out of the linear recurrence, using O(deg)
+    time per term and keeping only the last deg terms around.
+    :param jump: computes an arbitrary a[n] directly, used to seed the window when start > 0
+    '''
+    # window holds a[n - 1], a[n - 2], ..., a[n - d]
+    if start and recurrence:
+        jump = jump or jumper(top, recurrence)
+        window = deque([jump(start - k) for k in range(1, len(recurrence) + 1)], maxlen=len(recurrence))
+    else:
+        window = deque([0] * len(recurrence), maxlen=len(recurrence))
+    n = start
+    while True:
+        coefficient = top.get(n, 0) + sum(c * a for c, a in zip(recurrence, window))
+        if recurrence: window.appendleft(coefficient)
+        yield coefficient
+        n += 1
+
+
+def mulmod(p, q, recurrence):
+    '''
+    Multiplies two polynomials (as coefficient lists of length d) modulo the characteristic
+    polynomial x**d - c[1] x**(d - 1) - ... - c[d] of the recurrence.
+    '''
+    d = len(recurrence)
+    product = [0] * (2 * d - 1)
+    for i, a in enumerate(p):
+        if not a: continue
+        for j, b in enumerate(q):
+            product[i + j] += a * b
+    # x**k = x**(k - d) * x**d = x**(k - d) * (c[1] x**(d - 1) + ... + c[d])
+    for k in range(2 * d - 2, d - 1, -1):
+        lead = product[k]
+        if not lead: continue
+        for j, c in enumerate(recurrence, 1):
+            product[k - j] += lead * c
+    return product[:d]
+
+
+def jumper(top, recurrence):
+    '''
+    Fiduccia's (or Kitamasa's) method: once the recurrence becomes homogeneous, every a[n]
+    is a fixed linear combination of d consecutive initial terms, and the weights of that
+    combination are the coefficients of x**n modulo the characteristic polynomial. These are
+    computed by repeated squaring, and the squarings x**(2**j) are shared by every query.
+    :return: a function that computes a[n] in O(deg^2 log n) time
+    '''
+    d = len(recurrence)
+    if not d:
+        return lambda n: top.get(n, 0)
+    # a[n] = c[1] a[n - 1] + ... + c[d] a[n - d] holds for every n >= offset + d
+    offset = max(0, max(top) + 1 - d) if top else 0
+    initial = list(islice(step(top, recurrence), offset + d))
+    # squares[j] = x**(2**j) modulo the characteristic polynomial
+    squares = [[0, 1] + [0] * (d - 2) if d > 1 else [recurrence[0]]]
+    # The jumper is shared between threads through the compiled regex, so squares only grows under a lock.
+    growing = threading.Lock()
+
+    def jump(n):
+        if n < 0: return 0
+        if n < offset + d: return initial[n]
+        weights = [1] + [0] * (d - 1)
+        e, j = n - offset, 0
+        while e:
+            if j == len(squares):
+                with growing:
+                    if j == len(squares):
+                        squares.append(mulmod(squares[-1], squares[-1], recurrence))
+            if e & 1:
+                weights = mulmod(weights, squares[j], recurrence)
+            e >>= 1
+            j += 1
+        return sum(w * a for w, a in zip(weights, initial[offset:]))
+
+    return jump
+
+
+def exact_coefficients(regex, what = None, use_overflow = True, start = 0, safe = False):
     '''
     from itertools import islice
     print("The first 10 coefficients of (0|1)* are")
     for coefficient in islice(exact_coefficients("(0|1)*"), 10):
       print(coefficient)
+
+    The rational form is computed only once, after which every further coefficient is
+    stepped out of the linear recurrence in O(deg) time.
+    :param start: the first n to yield, for consumers resuming in the middle of the sequence
     '''
-    n = 0
-    while True:
-        yield exact(regex, n, what, use_overflow) # TODO: inline this in the future so we don't recompute the quotients
-        n += 1
+    compiled = counted(regex, what, safe)
+    overflow, top, recurrence = linear_recurrence(compiled)
+    jump = compiled.stage('jumper', lambda: jumper(top, recurrence)) if start else None
+    for n, coefficient in enumerate(step(top, recurrence, start, jump), start):
+        if use_overflow:
+            yield int(round(coefficient + overflow.get(n, 0)))
+        else:
+            yield coefficient
 
 
 def newton(polynomial, roots):
@@ -77,6 +211,7 @@ def newton(polynomial, roots):
     Note: don't add too many iterations. Roundoff will kick in and we'll
     end up refining noise.
     '''
+    from numpy.linalg import norm
     derivatives = polynomial.deriv()
     # Heuristic: do two iterations
     if norm(derivatives(roots), 2) < 1e-5: return roots
@@ -92,10 +227,13 @@ def closed_form(polynomial, roots, symbolic=False):
     expressible number.
     :param symbolic: Return an exact symbolic representation (via sympy), for LaTeX
     '''
+    from numpy import array
+    from sympy import sympify
     x = []
+    prefetch(roots, 1e-4)
     for root in roots:
-        rl = mpmath.identify(root.real, tol=1e-4, maxcoeff=30)
-        im = mpmath.identify(root.imag, tol=1e-4, maxcoeff=30)
+        rl = identify(root.real, tol=1e-4, maxcoeff=30)
+        im = identify(root.imag, tol=1e-4, maxcoeff=30)
         if not rl:
             rl = root.real if not symbolic else sympify(rl).evalf(5)
         if not im:
@@ -149,32 +287,78 @@ def collate(clusters):
     for (root, multiplicity) in clusters.items():
         for k in range(1, multiplicity + 1):
             collection.append((root, k))
-    return sorted(collection)
+    return sorted(collection, key=lambda pair: (pair[0].real, pair[0].imag, pair[1]))
+
+
+def rational_coefficients(p):
+    '''
+    Recovers the exact (rational) coefficients of a polynomial whose coefficients are all within roundoff
+    of a fraction with a small denominator, or None if they are not.
+    '''
+    coefficients = []
+    for c in p.coefficients:
+        exact = Fraction(c).limit_denominator(1 << 20)
+        if abs(exact - c) > 1e-9 * max(1, abs(c)): return None
+        coefficients.append(int(exact) if exact.denominator == 1 else exact)
+    return Polynomial(coefficients)
+
+
+def unity(j, k):
+    from numpy import complex128
+    # exp(2 pi i j / k), with the roundoff in its vanishing parts cleaned up
+    root = cmath.exp(2j * math.pi * j / k)
+    real, imag = (0.0 if abs(part) < 1e-15 else part for part in (root.real, root.imag))
+    return real if not imag else complex128(real, imag)
+
+
+@timed('roots')
+def factored_roots(bottom, threshold = 1e-3):
+    '''
+    The roots of bottom along with their multiplicities. When bottom has exact coefficients, it is first factored
+    (see transfer.factor), so that the multiplicities are exact and the roots of unity come out in closed form. Only
+    the remaining square-free factors need numerical root finding, where their roots are simple and well separated.
+    Otherwise, the roots of bottom are found numerically and clustered into multiple roots.
+    :return: {root: multiplicity}
+    '''
+    from numpy.polynomial import Polynomial as P
+    exact = rational_coefficients(bottom)
+    if exact is None:
+        polynomial = P(bottom.coefficients)
+        roots = closed_form(polynomial, newton(polynomial, polynomial.roots()))
+        return dict(cluster_roots(polynomial, roots, threshold=threshold))
+    cyclotomic, rest = factor(exact)
+    clusters = {}
+    for k, multiplicity in cyclotomic:
+        for j in range(k):
+            if math.gcd(j, k) == 1:
+                clusters[unity(j, k)] = multiplicity
+    for g, multiplicity in rest:
+        polynomial = P([float(c) for c in g.coefficients])
+        for root in closed_form(polynomial, newton(polynomial, polynomial.roots())):
+            clusters[root] = multiplicity
+    return clusters
 
 
-def extract_coefficients_algebraically(regex, what = None, threshold = 1e-3):
-    ast = transfer(regex, what)
+def extract_coefficients_algebraically(regex, what = None, threshold = 1e-3, safe = False):
+    compiled = counted(regex, what, safe)
+    return compiled.stage(('algebraic', threshold), lambda: partial_fractions(compiled, threshold))
+
+
+def partial_fractions(compiled, threshold):
+    from numpy import array
+    from numpy.polynomial import Polynomial as P
+    from scipy.special import comb
     # rationalize(regex) = overflow(z) + top(z)/bottom(z), where the quotient is irreducible.
-    overflow, (top, bottom) = simplify(*rationalize(ast))
-    pow, _ = leading_term(bottom)
+    overflow, (top, bottom) = compiled.rational
     # Express our bottom polynomial as a numpy polynomial-vector.
-    polynomial = P([bottom[k] if k in bottom else 0 for k in range(pow + 1)])
-
-    # Compute, refine, and custer the roots
-    roots = polynomial.roots()
-    roots = newton(polynomial, roots)
-    roots = closed_form(polynomial, roots)
-    clusters = cluster_roots(polynomial, roots, threshold=threshold)
+    polynomial = P([float(c) for c in bottom.coefficients])
+    clusters, partial_coefficients = decompose(compiled, threshold)
 
     # roots of multiplicity k has expanded form binom[n+k-1,k-1] * (r)**(-n - k) * (-1)**k
-    if len(roots):
-        degree = len(roots)
+    if clusters:
         # This is the generator for the extended Vandermonde matrix augmented with the multiplicity of a root
         basis = lambda n: array(
             [comb(n + k - 1, k - 1) * (-1)**k * (root)**(-n - k) for (root, k) in collate(clusters)])
-        vandermonde_matrix = array([basis(n) for n in range(degree)])
-        target = array([exact(regex, n, what=what, use_overflow=False) for n in range(degree)])
-        partial_coefficients = solve(vandermonde_matrix, target)
 
         return (
             # A function that computes the coefficient for n
@@ -189,45 +373,261 @@ def extract_coefficients_algebraically(regex, what = None, threshold = 1e-3):
         )
 
 
-def enumerate_coefficients(regex, what = None, threshold = 1e-3):
-    formula = algebraic_form(regex, what, threshold)
-    def postprocess(number):
-        # if there is a I, make sure it's small
-        r, i = number.as_real_imag()
-        if abs(i) < threshold:
-            return r
+def decompose(compiled, threshold):
+    '''
+    The roots of the denominator of the rational form (with their multiplicities) and their partial coefficients
+    (see partial_residues). These are kept in the on-disk cache (see persistent), addressed by the rational form
+    itself, when there is one.
+    :return: ({root: multiplicity}, partial_coefficients)
+    '''
+    from numpy import array, complex128
+    _, (top, bottom) = compiled.rational
+
+    def compute():
+        clusters = factored_roots(bottom, threshold)
+        if not clusters:
+            return clusters, array([])
+        return clusters, array(partial_residues([float(c) for c in top.coefficients], float(bottom.coefficients[-1]),
+                                                clusters))
+
+    if not persistent.directory:
+        return compute()
+
+    def flatten():
+        clusters, partial_coefficients = compute()
+        return {
+            'roots': [complex(root) for root in clusters],
+            # Whether each root was real, so that it comes back as a float rather than a complex.
+            'real': [int(not isinstance(root, complex)) for root in clusters],
+            'multiplicities': list(clusters.values()),
+            'partial': list(partial_coefficients),
+        }
+    address = persistent.key('residues', threshold, [str(c) for c in top.coefficients],
+                             [str(c) for c in bottom.coefficients])
+    fields = persistent.fetch(address, flatten)
+    clusters = dict(
+        (root.real if real else complex128(root), multiplicity)
+        for root, real, multiplicity in zip(fields['roots'], fields['real'], fields['multiplicities']))
+    return clusters, array(fields['partial'])
+
+
+def taylor(coefficients, root, count):
+    '''
+    The first count Taylor coefficients of the polynomial (low order first) around root, by repeated synthetic
+    division by (z - root).
+    '''
+    expansion = []
+    for _ in range(count):
+        quotient, remainder = [], 0
+        for c in reversed(coefficients):
+            remainder = remainder * root + c
+            quotient.append(remainder)
+        expansion.append(quotient.pop() if quotient else 0)
+        coefficients = quotient[::-1]
+    return expansion
+
+
+@timed('residues')
+def partial_residues(top, leading, clusters, at = None):
+    '''
+    The partial coefficients of top(z)/bottom(z), where bottom(z) = leading * prod over roots of (z - r)**m, by their
+    residues: the coefficient of 1/(z - r)**k, for a root r of multiplicity m, is the (m - k)-th Taylor coefficient
+    around r of
+        h(z) = top(z) / (bottom(z) / (z - r)**m) = top(z) / (leading * prod over the other roots s of (z - s)**m_s)
+    whose denominator is kept in factored form around r, as leading * prod (r - s)**m_s times
+        prod (1 + w/(r - s))**m_s = exp(sum over j of (-1)**(j + 1) P[j] w**j / j)
+    where P[j] = sum of m_s (r - s)**-j, so that bottom is never expanded around one of its own roots. This only
+    depends on the distances between the roots, takes O(deg(bottom)**2) time, and works in any arithmetic.
+    :param top: the coefficients of top, as floats (or as mpmath numbers, along with leading and the roots)
+    :param clusters: {root: multiplicity}
+    :param at: {root: refined root}, to take the residues around the refined roots instead
+    :return: the partial coefficients, in the order of collate(clusters)
+    '''
+    roots = [(at[root] if at else root, multiplicity) for root, multiplicity in clusters.items()]
+    partial = {}
+    for i, (key, (root, multiplicity)) in enumerate(zip(clusters, roots)):
+        scale, sums = leading, [0] * multiplicity
+        for j, (other, m) in enumerate(roots):
+            if i == j: continue
+            distance = root - other
+            scale *= distance ** m
+            power = 1
+            for order in range(1, multiplicity):
+                power /= distance
+                sums[order] += m * power
+        # The Taylor coefficients of exp(sum of (-1)**(j + 1) P[j] w**j / j), by e[n] = sum of k a[k] e[n - k] / n
+        logarithm = [0] + [(-1) ** (j + 1) * sums[j] / j for j in range(1, multiplicity)]
+        rest = [1]
+        for n in range(1, multiplicity):
+            rest.append(sum(k * logarithm[k] * rest[n - k] for k in range(1, n + 1)) / n)
+        # h = taylor(top) / (scale * rest), as power series in w = z - r
+        numerator, h = taylor(top, root, multiplicity), []
+        for n in range(multiplicity):
+            h.append(numerator[n] - sum(rest[k] * h[n - k] for k in range(1, n + 1)))
+        for k in range(1, multiplicity + 1):
+            partial[key, k] = h[multiplicity - k] / scale
+    return [partial[pair] for pair in collate(clusters)]
+
+
+def enumerate_coefficients(regex, what = None, threshold = 1e-3, safe = False, precision = None):
+    evaluate = evaluator(regex, what, threshold, precision, safe)
+    # Evaluate the closed form a block of n at a time.
+    return (value for start in itertools.count(0, 64) for value in evaluate(range(start, start + 64)))
+
+
+def evaluate_many(regex, ns, what = None, threshold = 1e-3, precision = None, safe = False):
+    '''
+    Evaluates the closed form of the number of words of size n in regex for a whole array of n at once.
+    :param precision: None to evaluate in float64 through numpy, or a number of decimal digits to evaluate in
+                      multiprecision through mpmath, which also works for n large enough to overflow a float64
+    :return: an array of the (real) values, in the same order as ns
+    '''
+    return evaluator(regex, what, threshold, precision, safe)(ns)
+
+
+def evaluator(regex, what = None, threshold = 1e-3, precision = None, safe = False):
+    '''
+    Compiles the closed form
+        a[n] = sum of c * binom(n + k - 1, k - 1) * (-1)**k * root**(-n - k) + overflow[n]
+    over the roots of the denominator (with multiplicity k) and their partial coefficients c into a function
+    that evaluates it over arrays of n, which is much faster than substituting into algebraic_form.
+    '''
+    compiled = counted(regex, what, safe)
+    if precision is None:
+        return compiled.stage(('evaluator', threshold), lambda: vectorized(compiled, threshold))
+    return compiled.stage(('evaluator', threshold, precision), lambda: multiprecision(compiled, threshold, precision))
+
+
+def real(values, threshold):
+    # if there is a I, make sure it's small, relative to the count, since the roundoff of the terms grows with it
+    if any(abs(value.imag) >= threshold * max(1, abs(value.real)) for value in values):
         raise Exception("Coefficients cannot be complex.")
-    return (postprocess(evaluate_expression(formula, n).evalf(32)) for n in itertools.count())
+    return [value.real for value in values]
+
+
+def vectorized(compiled, threshold):
+    from numpy import array, int64
+    from scipy.special import comb
+    # Ill-conditioned partial fractions (e.g. with a root of high multiplicity) lose most of the digits of a
+    # float64 solve, so the roots and partial coefficients are still prepared at a higher precision.
+    collection, roots, partial_coefficients, overflow = refine(compiled, threshold, 30)
+    roots = array([complex(roots[root]) for (root, _) in collection], dtype=complex)
+    ks = array([k for (_, k) in collection], dtype=int64)
+    weights = array([complex(c) for c in partial_coefficients], dtype=complex) * (-1.0) ** ks
+    boundary = array([overflow.get(n, 0) for n in range(max(overflow) + 1 if overflow else 0)], dtype=float)
+
+    def evaluate_many(ns):
+        ns = array(ns, dtype=int64).reshape(-1)
+        # terms[i, j] = binom(n[i] + k[j] - 1, k[j] - 1) * root[j]**(-n[i] - k[j])
+        shifted = ns[:, None] + ks[None, :]
+        terms = comb(shifted - 1, ks - 1) * roots ** -shifted
+        values = array(real(terms.dot(weights), threshold), dtype=float)
+        inside = ns < len(boundary)
+        values[inside] += boundary[ns[inside]]
+        return values
+
+    return evaluate_many
+
+
+def multiprecision(compiled, threshold, precision):
+    import mpmath
+    collection, roots, partial_coefficients, overflow = refine(compiled, threshold, precision)
+
+    def evaluate_many(ns):
+        with mpmath.workdps(precision):
+            values = [mpmath.fsum(mpmath.binomial(n + k - 1, k - 1) * (-1)**k * roots[root]**(-n - k) * c
+                                  for (root, k), c in zip(collection, partial_coefficients)) for n in ns]
+            return [value + overflow.get(n, 0) for n, value in zip(ns, real(values, threshold))]
+
+    return evaluate_many
+
+
+@timed('refine')
+def refine(compiled, threshold, precision):
+    '''
+    Refines the roots of the denominator to the given precision by Newton's method (a root of multiplicity k is a
+    simple root of the (k - 1)-th derivative of the denominator), and then recomputes the partial coefficients
+    (see partial_residues) at that precision around the refined roots.
+    :return: (collated roots, {root: refined root}, partial coefficients, overflow)
+    '''
+    import mpmath
+
+    def derive():
+        _, (clusters, _, _, _, (overflow, (top, bottom))) = \
+            extract_coefficients_algebraically(compiled, threshold=threshold)
+        collection = collate(clusters)
+        number = lambda c: mpmath.mpf(c.numerator) / c.denominator if isinstance(c, Fraction) else mpmath.mpf(c)
+        with mpmath.workdps(precision):
+            polynomial = rational_coefficients(bottom) or bottom
+            roots = {}
+            for root, multiplicity in clusters.items():
+                derived = polynomial
+                for _ in range(multiplicity - 1):
+                    derived = derivative(derived)
+                coefficients = [number(c) for c in reversed(derived.coefficients)]
+                try:
+                    roots[root] = mpmath.findroot(lambda z: mpmath.polyval(coefficients, z), mpmath.mpc(root))
+                except ValueError:
+                    # Newton's method did not converge to the working precision, so keep the original root.
+                    roots[root] = mpmath.mpc(root)
+            top = rational_coefficients(top) or top
+            partial_coefficients = partial_residues([number(c) for c in top.coefficients],
+                                                    number(polynomial.coefficients[-1]), clusters, at=roots)
+        return collection, roots, partial_coefficients, overflow
+
+    return compiled.stage(('refine', threshold, precision), derive)
+
+
+def prefetch(numbers, tol):
+    '''
+    Identifies the real and imaginary parts of every number at once, so that the many new constants of a
+    large polynomial get spread over a process pool (see constants.identify_many).
+    '''
+    identify_many([number.real for number in numbers] + [number.imag for number in numbers], tol=tol, maxcoeff=30)
 
 
 def inverse_symbolic(n, threshold=1e-5):
-    rl = mpmath.identify(n.real, tol=1e-3, maxcoeff=30)
-    im = mpmath.identify(n.imag, tol=1e-3, maxcoeff=30)
-    if not rl or abs(n.real - (nsimplify(rl).evalf())) > threshold:
-        rl = nsimplify(n.real).evalf(5)
-    if not im or abs(n.imag - (nsimplify(im).evalf())) > threshold:
-        im = nsimplify(n.imag).evalf(5)
-    return (sympify(rl) + sympify(im) * 1j)
+    from sympy import nsimplify, sympify, srepr
+
+    def symbolic(x):
+        x = float(x)
+        def derive():
+            identified = identify(x, tol=1e-3, maxcoeff=30)
+            if not identified or abs(x - (nsimplify(identified).evalf())) > threshold:
+                return srepr(nsimplify(x).evalf(5))
+            return identified
+        # nsimplify runs mpmath.identify as well, so its answer is memoized along with the constant.
+        return sympify(constants.remember(constants.key(x, threshold, 'symbolic'), derive))
+    return (symbolic(n.real) + symbolic(n.imag) * 1j)
+
 
+def algebraic_form(regex, what = None, threshold = 1e-3, safe = False):
+    compiled = counted(regex, what, safe)
+    return compiled.stage(('algebraic_form', threshold), lambda: closed_series(compiled, threshold))
 
-def algebraic_form(regex, what = None, threshold = 1e-3):
+
+@timed('symbolic form')
+def closed_series(compiled, threshold):
+    from sympy import sympify, binomial, DiracDelta
     _, (clusters, basis, partial_coefficients, bottom, (overflow, (top, bottom))) = \
-        extract_coefficients_algebraically(regex, what, threshold)
+        extract_coefficients_algebraically(compiled, threshold=threshold)
     n = sympify('n')
     series = 0
+    prefetch([root for (root, _) in collate(clusters)] + list(partial_coefficients), 1e-3)
     for i, (root, k) in enumerate(collate(clusters)):
         symbolic_root = inverse_symbolic(root)
         partial_coefficient = inverse_symbolic(partial_coefficients[i])
         series += partial_coefficient * binomial(n + k - 1, k - 1) * ((-1) ** k) * (symbolic_root ** (-n - k))
+    constants.flush()
     for k, coefficient in overflow.items():
         series += coefficient * DiracDelta(n - k)
     return series
 
 
-def generating_function(regex, what = None):
-    ast = transfer(regex, what)
+def generating_function(regex, what = None, safe = False):
+    from sympy import sympify
     # rationalize(regex) = overflow(z) + top(z)/bottom(z), where the quotient is irreducible.
-    overflow, (top, bottom) = simplify(*rationalize(ast))
+    overflow, (top, bottom) = counted(regex, what, safe).rational
     z = sympify('z')
     quotient = sum(c * z**k for (k, c) in overflow.items())
     p = sum(c * z**k for (k, c) in top.items())
@@ -236,64 +636,130 @@ def generating_function(regex, what = None):
 
 
 def evaluate_expression(expr, n):
+    from sympy import DiracDelta
     return expr.subs('n', n).subs(DiracDelta(0), 1)
 
 
-def check_on_oeis(regex, what = None, start = 0, window = 10):
+def check_on_oeis(regex, what = None, start = 0, window = 10, safe = False, index = None):
+    '''
+    Looks the counts of regex (from size start, without any leading zeros, for window more sizes) up in the OEIS.
+    :param index: a local OEIS index (see oeis.build) or the directory holding one, which defaults to the
+                  REGEX_ENUMERATE_OEIS environment variable. Without one, the OEIS is queried online through pyoeis.
+    '''
     started = False
     first = start
     sequence = []
-    for i, count in enumerate(exact_coefficients(regex, what)):
-        if i < start: continue
+    # Jump straight to start, rather than stepping through every count before it.
+    for i, count in enumerate(exact_coefficients(regex, what, start = start, safe = safe), start):
         # remove prefixes of zeroes
-        if not started and count is 0: continue
+        if not started and count == 0: continue
         if not started:
             started = True
             first = i
         if i - first > window: break
         sequence.append(count)
+    index = index or os.environ.get('REGEX_ENUMERATE_OEIS')
+    if index:
+        from regex_enumerate.oeis import open_index
+        return (open_index(index) if isinstance(index, str) else index).lookup_by_terms(sequence, max_seqs=20)
     try:
         import pyoeis
-    except NameError:
-        raise NotImplementedError("Cannot find pyoeis. Make sure that it is installed.")
+    except ImportError:
+        raise NotImplementedError("Cannot find pyoeis. Make sure that it is installed, or use a local index.")
     return pyoeis.OEISClient().lookup_by_terms(sequence, max_seqs=20)
 
 
-def matrix_method(regex, threshold=1e-3):
-    nfa = compile(parse(regex))
-    dfa = determinize(nfa)
-    _, dfa, accepts, num_states = reconstruct(*dfa)
+def walk(dfa):
+    '''
+    Streams the number of words of length n = 0, 1, 2, ... accepted by a DFA, by pushing the vector that counts
+    the words of length n leading into each state forward one letter at a time along its transitions. Each step
+    costs O(|transitions|). The counts are kept in an int64 vector (stepped by a sparse matrix product) for as
+    long as they provably cannot overflow, and in exact Python integers from then on.
+    :param dfa: (start, final, dfa) as returned by nfa.determinize or nfa.minimize
+    '''
+    from numpy import zeros, int64, ones
+    from scipy.sparse import csr_matrix
+    start, final, transitions = dfa
+    index = {start: 0}
+    for (p, q, _) in transitions:
+        for state in (p, q):
+            if state not in index: index[state] = len(index)
+    n = len(index)
+    sources = [index[p] for (p, _, _) in transitions]
+    targets = [index[q] for (_, q, _) in transitions]
+    accepting = [i for state, i in index.items() if final in state]
+
+    matrix = csr_matrix((ones(len(sources), dtype=int64), (targets, sources)), shape=(n, n), dtype=int64)
+    vector = zeros(n, dtype=int64)
+    vector[0] = 1
+    # A step can at most multiply the largest count by the largest in-degree, and the total adds up
+    # len(accepting) counts, so neither can overflow as long as the largest count stays within bound.
+    fan_in = int(matrix.sum(axis=1).max())
+    bound = (1 << 62) // max(fan_in, len(accepting), 1)
+    while vector.max() <= bound:
+        yield int(vector[accepting].sum())
+        vector = matrix.dot(vector)
+
+    counts = [int(count) for count in vector]
+    while True:
+        yield sum(counts[i] for i in accepting)
+        successor = [0] * n
+        for u, v in zip(sources, targets):
+            successor[v] += counts[u]
+        counts = successor
+
+
+def dfa_coefficients(regex, N = None, minimal = True):
+    '''
+    Counts the words of length n = 0, 1, ..., N (or indefinitely, if N is None) in the language of regex by
+    walking its DFA, so that every word is counted exactly once no matter how ambiguous the regex is.
+    '''
+    compiled = compile(regex)
+    counts = walk(compiled.minimal_dfa if minimal else compiled.dfa)
+    return counts if N is None else islice(counts, N + 1)
+
+
+@timed('matrix method')
+def matrix_method(regex, threshold=1e-3, minimal=True):
+    from numpy import array, zeros, eye
+    from numpy.linalg import solve, eigvals, det
+    from scipy.special import comb
+    from sympy import sympify, binomial, DiracDelta
+    compiled = compile(regex)
+    _, dfa, accepts, num_states = reconstruct(*(compiled.minimal_dfa if minimal else compiled.dfa))
     A = zeros((num_states, num_states))
-    e_1 = eye(num_states, 1)
-    e_accepts = array([1 if i + 1 in accepts else 0 for i in range(num_states)])
     for (u, v, _) in dfa: A[v - 1, u - 1] += 1
     eigenvalues = eigvals(A)
     clusters = cluster_roots(lambda root: det(A - root * eye(num_states)), eigenvalues, threshold)
-    clusters = {root : key for root, key in clusters.items() if abs(root) > threshold ** 2}
+    # Zero eigenvalues only contribute to n < num_states, which the boundary corrections below cover. A defective
+    # zero eigenvalue of multiplicity m gets smeared out to about eps**(1/m), so drop everything near zero.
+    clusters = {root : key for root, key in clusters.items() if abs(root) > threshold}
     collection = collate(clusters)
 
-    exact = lambda n: dot(e_accepts, dot(matrix_power(A, n), e_1))
+    # Both the targets of the Vandermonde system and the boundary corrections are streamed out of the DFA exactly.
+    exact = list(dfa_coefficients(compiled, num_states + len(collection), minimal))
     if collection:
         degree = len(collection)
         basis = lambda n: array([comb(n+k-1, k-1) * root**(n-k) for (root, k) in collate(clusters)])
         vandermonde_matrix = array([basis(num_states + n) for n in range(degree)])
-        target = array([exact(num_states + n) for n in range(degree)])
+        target = array([float(exact[num_states + n]) for n in range(degree)])
         partial_coefficients = solve(vandermonde_matrix, target)
     else:
         partial_coefficients = array([])
     n = sympify('n')
     series = sympify('0')
+    prefetch([root for (root, _) in collection] + list(partial_coefficients), 1e-3)
     for i, (root, k) in enumerate(collection):
         symbolic_root = inverse_symbolic(root)
-        partial_coefficient = inverse_symbolic(partial_coefficients[i][0])
+        partial_coefficient = inverse_symbolic(partial_coefficients[i])
         series += partial_coefficient * binomial(n + k - 1, k - 1) * (symbolic_root ** (n - k))
+    constants.flush()
     for i in range(num_states):
-        delta = exact(i)[0] - evaluate_expression(series, i)
+        delta = exact[i] - evaluate_expression(series, i)
         series += DiracDelta(n - i) * delta
     return series
 
 
-
 if __name__ == '__main__':
     from sympy import latex
 
@@ -311,7 +777,7 @@ if __name__ == '__main__':
     for regex in regexes:
         print("Checking %s." % regex)
         exact_form = list(islice(exact_coefficients(regex), 20))
-        closed_series = list(islice(enumerate_coefficients(regex), 20))
+        closed = list(islice(enumerate_coefficients(regex), 20))
         # algebraic = list(islice(map(lambda x: int(round(x)), enumerate_coefficients(regex)), 20))
         # print("Expecting %s,\nActual    %s." % (exact_form, algebraic))
         # print("It's algebraic form is %s" % algebraic_form(regex))
@@ -320,6 +786,6 @@ if __name__ == '__main__':
         series = matrix_method(regex)
         print('Expecting:', exact_form)
         print('Actual:', [int(round(abs(evaluate_expression(series, i).evalf()))) for i in range(20)])
-        print('enumerate_coefficients:', closed_series)
+        print("enumerate_coefficients:", closed)
         print('Series:', latex(series))
         print('algebraic_form:', algebraic_form(regex))
\ No newline at end of file
@@ -1,5 +1,6 @@
 import collections
 import functools
+import threading
 
 try:
     from functools import lru_cache
@@ -30,4 +31,90 @@ except ImportError:
        def __get__(self, obj, objtype):
           '''Support instance methods.'''
           return functools.partial(self.__call__, obj)
-    memoized = lambda: memoized_wrapper
\ No newline at end of file
+    memoized = lambda: memoized_wrapper
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize', 'weight', 'maxweight'])
+
+
+class LRUCache(object):
+    '''
+    A bounded least-recently-used cache. Besides capping the number of entries, it also caps
+    their total weight, as measured by weigh(value), so that a handful of huge entries cannot
+    crowd out the memory budget. Since values may keep growing after they are inserted (for
+    example, objects that lazily compute more of themselves), entries are re-weighed whenever
+    they are looked up. Every method holds a lock, so the cache can be shared between threads.
+    '''
+    def __init__(self, maxsize = 256, maxweight = None, weigh = lambda value: 1):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.entries = collections.OrderedDict()
+        self.weights = {}
+        self.weight = 0
+        self.hits = self.misses = self.evictions = 0
+        # Reentrant, since get and put hold it while they reweigh and evict.
+        self.lock = threading.RLock()
+
+    def get(self, key, default = None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            self.reweigh(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.entries.pop(key)
+                self.weight -= self.weights.pop(key)
+            self.entries[key] = value
+            self.weights[key] = 0
+            self.reweigh(key)
+
+    def reweigh(self, key):
+        with self.lock:
+            if key not in self.entries: return
+            weight = self.weigh(self.entries[key])
+            self.weight += weight - self.weights[key]
+            self.weights[key] = weight
+            self.evict(keep = key)
+
+    def evict(self, keep = None):
+        # Never evict the entry that is currently in use (always the most recent one), even if it alone
+        # is over budget.
+        with self.lock:
+            while self.entries and (len(self.entries) > self.maxsize or
+                                    (self.maxweight is not None and self.weight > self.maxweight)):
+                key = next(iter(self.entries))
+                if key == keep: break
+                self.entries.pop(key)
+                self.weight -= self.weights.pop(key)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.weights.clear()
+            self.weight = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self.entries), self.weight,
+                             self.maxweight)
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
@@ -1,121 +1,316 @@
-from collections import defaultdict
+from array import array
+from collections import defaultdict, deque
 
 from regex_enumerate.parse import parse
 from regex_enumerate.memoize import memoized
+from regex_enumerate import profiling
+from regex_enumerate.profiling import timed
 
 class NFA(object):
-    next = 0
-    def __init__(self, p, q, transitions):
-        self.p = p
-        self.q = q
-        self.transitions = transitions
-
-    @classmethod
-    def eps(cls):
-        p = cls.fresh()
-        return NFA(p, p, set())
-
-    @classmethod
-    def fresh(cls):
-        cls.next += 1
-        return cls.next
+    '''
+    A Thompson NFA. States are numbered locally from 1 within each compilation, and the
+    transitions are kept in three parallel, append-only arrays (source, target, symbol),
+    where the symbol '%' denotes an epsilon-transition. Since nothing is shared between
+    two NFAs, separate compilations can safely run concurrently.
+    '''
+    __slots__ = ('p', 'q', 'states', 'sources', 'targets', 'symbols')
+
+    def __init__(self):
+        self.p = self.q = None
+        self.states = 0
+        self.sources = array('l')
+        self.targets = array('l')
+        self.symbols = []
+
+    def fresh(self):
+        self.states += 1
+        return self.states
+
+    def add(self, p, q, c):
+        self.sources.append(p)
+        self.targets.append(q)
+        self.symbols.append(c)
+
+    @property
+    def transitions(self):
+        return zip(self.sources, self.targets, self.symbols)
+
+    def __len__(self):
+        return len(self.symbols)
 
     def __str__(self):
-        return str((self.p, self.q, self.transitions))
+        return str((self.p, self.q, list(self.transitions)))
 
 
+@timed('thompson')
 def compile(ast):
-    t, data = ast
-    if t == '|':
-        if not data: return None
-        if len(data) == 1: return compile(*data)
-        else:
-            rest = compile((t, data[1:]))
-            current = compile(data[0])
-            if not rest: return current
-            p, q = NFA.fresh(), NFA.fresh()
-            a, b, c, d = current.p, current.q, rest.p, rest.q
-            return NFA(p, q,
-                       current.transitions | rest.transitions | {(p, a, '%'), (p, c, '%'), (b, q, '%'), (d, q, '%')})
-    elif t == '.':
-        if not data: return NFA.eps()
-        if len(data) == 1: return compile(*data)
-        else:
-            rest = compile((t, data[1:]))
-            current = compile(data[0])
-            if not rest: return rest
-            a, b, c, d = current.p, current.q, rest.p, rest.q
-            return NFA(a, d, current.transitions | rest.transitions | {(b, c, '%')})
-    elif t == '*':
-        # (p -> q)* = s -> p -> q -> t + q -> s + s -> t
-        sub = compile(data)
-        s = NFA.fresh()
-        t = NFA.fresh()
-        return NFA(s, t, sub.transitions | {(s, sub.p, '%'), (sub.q, t, '%'), (sub.q, sub.p, '%'), (s, t, '%')})
-    elif t == 'eps':
-        return NFA.eps()
-    elif t == 'tok':
-        # 0 -x-> 1
-        p, q = NFA.fresh(), NFA.fresh()
-        return NFA(p, q, {(p, q, data)})
-
+    '''
+    Compiles a regex tree into a Thompson NFA.
+    '''
+    nfa = NFA()
 
+    def fragment(ast):
+        '''
+        Adds the states and transitions for ast to the nfa, and returns its (entry, exit) states.
+        '''
+        t, data = ast
+        if t == '|':
+            if len(data) == 1: return fragment(*data)
+            # An empty alternation has no path from p to q.
+            p, q = nfa.fresh(), nfa.fresh()
+            for sub in data:
+                a, b = fragment(sub)
+                nfa.add(p, a, '%')
+                nfa.add(b, q, '%')
+            return p, q
+        elif t == '.':
+            if not data:
+                p = nfa.fresh()
+                return p, p
+            p, q = fragment(data[0])
+            for sub in data[1:]:
+                a, b = fragment(sub)
+                nfa.add(q, a, '%')
+                q = b
+            return p, q
+        elif t == '*':
+            # (p -> q)* = s -> p -> q -> t + q -> s + s -> t
+            p, q = fragment(data)
+            s, t = nfa.fresh(), nfa.fresh()
+            nfa.add(s, p, '%')
+            nfa.add(q, t, '%')
+            nfa.add(q, p, '%')
+            nfa.add(s, t, '%')
+            return s, t
+        elif t == 'eps':
+            p = nfa.fresh()
+            return p, p
+        elif t == 'tok':
+            # 0 -x-> 1
+            p, q = nfa.fresh(), nfa.fresh()
+            nfa.add(p, q, data)
+            return p, q
+        raise Exception("IllegalState")
+
+    nfa.p, nfa.q = fragment(ast)
+    return nfa
+
+
+@timed('determinize')
 def determinize(nfa):
-    @memoized()
+    '''
+    Subset construction, driven by a worklist of unexplored DFA states. The NFA transitions are
+    first indexed by source state, so that each step only looks at the transitions leaving the
+    current subset, and the %-closure of every NFA state is computed at most once. Each DFA
+    state is keyed by the frozenset of NFA states it stands for and is expanded exactly once, so
+    the construction runs in time roughly linear in the number of DFA transitions.
+    :return: (start, final, dfa) where dfa is a list of (source subset, target subset, character)
+    '''
+    epsilons = defaultdict(list)
+    moves = defaultdict(lambda: defaultdict(list))
+    for (p, q, c) in nfa.transitions:
+        if c == '%':
+            epsilons[p].append(q)
+        else:
+            moves[p][c].append(q)
+
+    closures = {}
     def closure(s):
         '''
         Computes the set of states reachable by s through just %-transitions
         '''
-        worklist = [s]
-        seen = set()
-        while worklist:
-            u = worklist.pop(0)
-            if u in seen: continue
-            seen.add(u)
-            for (p, q, c) in nfa.transitions:
-                if p == u and c == '%':
-                    worklist.append(q)
-        return seen
-
-    states = {}
-
-    def construct(points, first = True):
-        # close the points
+        if s not in closures:
+            worklist = [s]
+            seen = {s}
+            while worklist:
+                u = worklist.pop()
+                for q in epsilons[u]:
+                    if q not in seen:
+                        seen.add(q)
+                        worklist.append(q)
+            closures[s] = frozenset(seen)
+        return closures[s]
+
+    def close(points):
         state = set()
         for point in points:
-            state.update(closure(point))
-
-        key = tuple(sorted(state))
-        if key in states and not first: return state, states[key], False
-        if key not in states:
-            states[key] = []
-        changed = False
-
+            state |= closure(point)
+        return frozenset(state)
+
+    start = close([nfa.p])
+    seen = {start}
+    worklist = deque([start])
+    dfa = []
+    while worklist:
+        state = worklist.popleft()
         # find all transitions out of state
         out = defaultdict(set)
         for point in state:
-            for (p, q, c) in nfa.transitions:
-                if point == p and c != '%':
-                    out[c].add(q)
-
-        dfa = []
-        for c, into in out.items():
-            next, rest, cur = construct(into, False)
-            changed |= cur
-            dfa += rest
+            for c, into in moves[point].items():
+                out[c].update(into)
+        for c in sorted(out):
+            next = close(out[c])
+            if next not in seen:
+                seen.add(next)
+                worklist.append(next)
             dfa.append((state, next, c))
+    if profiling.active is not None:
+        profiling.maximum('dfa states', len(seen))
+        profiling.maximum('dfa transitions', len(dfa))
+    return (start, nfa.q, dfa)
 
-        if sorted(dfa) != sorted(states[key]):
-            states[key] = list(dfa)
-            changed = True
-        return state, dfa, changed
 
-    start, dfa, changed = construct({nfa.p})
-    iterations = 10
-    while changed and iterations > 0:
-        start, dfa, changed = construct({nfa.p})
-        iterations -= 1
-    return (start, nfa.q, dfa)
+@timed('minimize')
+def minimize(dfa):
+    '''
+    Hopcroft's partition refinement. States are first split into accepting and rejecting ones,
+    and blocks are then refined against the preimages of the (smaller halves of) previously
+    split blocks until every block is a class of equivalent states. Missing transitions are
+    treated as going into an implicit dead state, and every state equivalent to it (i.e. that
+    can never reach an accepting state) is dropped along with it.
+    :param dfa: (start, final, dfa) as returned by determinize
+    :return: the smallest equivalent (start, final, dfa), where each state is represented by
+             one of the subsets that it merges
+    '''
+    start, final, transitions = dfa
+    states = [start]
+    index = {start: 0}
+    for (p, q, _) in transitions:
+        for state in (p, q):
+            if state not in index:
+                index[state] = len(states)
+                states.append(state)
+    sink = len(states)
+    alphabet = sorted(set(c for (_, _, c) in transitions))
+
+    # inverse[c][q] lists the states that go into q on c
+    inverse = dict((c, defaultdict(list)) for c in alphabet)
+    defined = set()
+    for (p, q, c) in transitions:
+        inverse[c][index[q]].append(index[p])
+        defined.add((index[p], c))
+    for c in alphabet:
+        for i in range(sink + 1):
+            if i == sink or (i, c) not in defined:
+                inverse[c][sink].append(i)
+
+    accepting = set(i for i, state in enumerate(states) if final in state)
+    blocks = [block for block in (accepting, set(range(sink + 1)) - accepting) if block]
+    block_of = [0] * (sink + 1)
+    for b, block in enumerate(blocks):
+        for i in block:
+            block_of[i] = b
+    worklist = set([min(range(len(blocks)), key=lambda b: len(blocks[b]))])
+    while worklist:
+        splitter = list(blocks[worklist.pop()])
+        for c in alphabet:
+            touched = defaultdict(set)
+            for q in splitter:
+                for p in inverse[c].get(q, ()):
+                    touched[block_of[p]].add(p)
+            for b, inside in touched.items():
+                if len(inside) == len(blocks[b]): continue
+                outside = blocks[b] - inside
+                blocks[b] = inside
+                blocks.append(outside)
+                for i in outside:
+                    block_of[i] = len(blocks) - 1
+                if b in worklist:
+                    worklist.add(len(blocks) - 1)
+                else:
+                    worklist.add(b if len(inside) <= len(outside) else len(blocks) - 1)
+
+    dead = block_of[sink]
+    representative = dict((b, states[min(block)]) for b, block in enumerate(blocks) if b != dead)
+    if block_of[0] == dead:
+        return (start, final, [])
+    minimal = set()
+    for (p, q, c) in transitions:
+        bp, bq = block_of[index[p]], block_of[index[q]]
+        if bq != dead:
+            minimal.add((bp, bq, c))
+    minimal = [(representative[bp], representative[bq], c) for (bp, bq, c) in sorted(minimal)]
+    if profiling.active is not None:
+        profiling.maximum('minimal dfa states', len(representative))
+        profiling.maximum('minimal dfa transitions', len(minimal))
+    return (representative[block_of[0]], final, minimal)
+
+
+@timed('ambiguity')
+def ambiguous(nfa):
+    '''
+    Decides, in polynomial time, whether some word has more than one accepting path through a Thompson
+    NFA. Accepting paths correspond one to one to parses of its regex, which transfer counts separately,
+    so this is exactly when the rational form overcounts.
+    Only the states on some path from the start to the final state matter. Among those, the %-transitions
+    must only ever give a unique %-path between any two states, as a %-cycle gives infinitely many paths
+    and two different %-paths give two. In that case, contracting the %-paths away loses no paths, and two
+    accepting paths for the same word in the resulting %-free automaton either use parallel copies of the
+    same transition, or pass through two different states i != j after the same prefix. The latter show
+    up as a pair (i, j) on some accepting path through the product of the automaton with itself.
+    :return: True if the NFA is ambiguous
+    '''
+    forward, backward = defaultdict(list), defaultdict(list)
+    for (p, q, _) in nfa.transitions:
+        forward[p].append(q)
+        backward[q].append(p)
+
+    def search(roots, edges):
+        seen = set(roots)
+        worklist = list(roots)
+        while worklist:
+            for q in edges[worklist.pop()]:
+                if q not in seen:
+                    seen.add(q)
+                    worklist.append(q)
+        return seen
+
+    useful = search([nfa.p], forward) & search([nfa.q], backward)
+    epsilons, moves = defaultdict(list), defaultdict(list)
+    for (p, q, c) in nfa.transitions:
+        if p in useful and q in useful:
+            if c == '%':
+                epsilons[p].append(q)
+            else:
+                moves[p].append((c, q))
+
+    # arcs[i][c] lists the states that i goes into on c once the %-paths are contracted
+    arcs = {}
+    accepting = set()
+    worklist = [nfa.p]
+    while worklist:
+        i = worklist.pop()
+        if i in arcs: continue
+        arcs[i] = defaultdict(list)
+        # Every state has at most one incoming %-transition from the %-closure of i exactly when the
+        # %-paths out of i are unique and acyclic.
+        closure, frontier = {i}, [i]
+        while frontier:
+            for q in epsilons[frontier.pop()]:
+                if q in closure: return True
+                closure.add(q)
+                frontier.append(q)
+        if nfa.q in closure: accepting.add(i)
+        for j in closure:
+            for (c, k) in moves[j]:
+                if k in arcs[i][c]: return True
+                arcs[i][c].append(k)
+                worklist.append(k)
+
+    start = (nfa.p, nfa.p)
+    reached, into = {start}, defaultdict(list)
+    worklist = [start]
+    while worklist:
+        i, j = pair = worklist.pop()
+        for c, targets in arcs[i].items():
+            for k in targets:
+                for l in arcs[j].get(c, ()):
+                    into[(k, l)].append(pair)
+                    if (k, l) not in reached:
+                        reached.add((k, l))
+                        worklist.append((k, l))
+    trimmed = search([pair for pair in reached if pair[0] in accepting and pair[1] in accepting], into)
+    return any(i != j for (i, j) in trimmed)
 
 
 def reconstruct(start, final_atom, dfa):
@@ -174,7 +369,92 @@ def reconstruct(start, final_atom, dfa):
     return R, dfa, accepts, n
 
 
-def reduce(regex):
+def interner():
+    '''
+    Hash-consing for regex trees: node(t, data) returns the one shared node for each distinct
+    (t, children) combination, where children are compared by identity. Regexes built this way
+    form a DAG in which equal subexpressions are a single object, so consumers can memoize
+    on node identity.
+    '''
+    table = {}
+    def node(t, data):
+        key = (t, tuple(map(id, data))) if t in ('|', '.') else (t, id(data)) if t == '*' else (t, data)
+        if key not in table:
+            # the node holds on to its children, so their ids stay unique while the table is alive
+            table[key] = (t, data)
+        return table[key]
+    return node
+
+
+@timed('elimination')
+def eliminate(dfa, accepts, n):
+    '''
+    Brzozowski-McCluskey state elimination. The DFA (with states 1..n and start state 1) is
+    extended with a fresh start 0 and a fresh final n + 1, and the states in between are then
+    eliminated one at a time, where eliminating k replaces every path i -> k -> j with an edge
+        i -> j = (i -> j) | (i -> k)(k -> k)*(k -> j).
+    Since the automaton is deterministic, every union and concatenation formed this way is
+    unambiguous. The next state to eliminate is always the one with the fewest (in-degree x
+    out-degree) new edges, which keeps the output small, and the output is a hash-consed DAG.
+    :return: an unambiguous regex tree for the language of the DFA
+    '''
+    node = interner()
+    zero, eps = node('|', []), node('eps', '%')
+
+    def union(a, b):
+        if a is zero: return b
+        if b is zero: return a
+        return node('|', [sub for x in (a, b) for sub in (x[1] if x[0] == '|' else [x])])
+
+    def concat(*parts):
+        if any(part is zero for part in parts): return zero
+        parts = [sub for x in parts if x is not eps for sub in (x[1] if x[0] == '.' else [x])]
+        return node('.', parts) if len(parts) > 1 else parts[0] if parts else eps
+
+    def star(a):
+        return eps if a is zero or a is eps else node('*', a)
+
+    start, final = 0, n + 1
+    out = defaultdict(dict)
+    into = defaultdict(dict)
+    def connect(i, j, regex):
+        out[i][j] = into[j][i] = union(out[i].get(j, zero), regex)
+    for (p, q, c) in dfa:
+        connect(p, q, node('tok', c))
+    connect(start, 1, eps)
+    for k in accepts:
+        connect(k, final, eps)
+
+    remaining = set(range(1, n + 1))
+    while remaining:
+        cost = lambda k: ((len(into[k]) - (k in into[k])) * (len(out[k]) - (k in out[k])), k)
+        k = min(remaining, key=cost)
+        remaining.remove(k)
+        loop = star(out[k].pop(k, zero))
+        into[k].pop(k, None)
+        for i, ik in into.pop(k, {}).items():
+            out[i].pop(k)
+            for j, kj in out[k].items():
+                connect(i, j, concat(ik, loop, kj))
+        for j in out.pop(k, {}):
+            into[j].pop(k)
+    return out[start].get(final, zero)
+
+
+def reduce(regex, memo = None):
+    '''
+    Canonicalizes operations on 0 and %, and flattens nested alternations and concatenations.
+    Shared subexpressions (as produced by eliminate) are reduced only once, and stay shared.
+    '''
+    if memo is None: memo = {}
+    key = id(regex)
+    if key not in memo:
+        # hold on to regex so that its id cannot be reused while memo is alive
+        memo[key] = (regex, reduce_node(regex, lambda sub: reduce(sub, memo)))
+    return memo[key][1]
+
+
+def reduce_node(regex, reduce):
     # canonicalize operations on 0 and %
     zero = ('|', [])
     eps = lambda x: x == ('eps', '%') or x == ('.', [])
@@ -183,39 +463,43 @@ def reduce(regex):
     if eps(regex): return ('eps', '%')
 
     if t == '|':
-        rest = [sub for sub in map(reduce, data) if sub != zero]
+        rest = []
+        for sub in map(reduce, data):
+            if sub == zero: continue
+            # (e + (f + g)) = (e + f + g)
+            rest.extend(sub[1] if sub[0] == '|' else [sub])
         nullable = [sub for sub in rest if eps(sub)]
         rest = [sub for sub in rest if not eps(sub)]
         if nullable: rest += [('eps', '%')]
-        if len(rest) is 1: return rest[0]
+        if len(rest) == 1: return rest[0]
         return ('|', rest) if rest else zero
 
     if t == '.':
-        rest = [sub for sub in map(reduce, data) if not eps(sub)]
+        rest = []
+        for sub in map(reduce, data):
+            if eps(sub): continue
+            # (e . (f . g)) = (e . f . g)
+            rest.extend(sub[1] if sub[0] == '.' else [sub])
         if zero in rest: return zero
-        if len(rest) is 1: return rest[0]
+        if len(rest) == 1: return rest[0]
         return ('.', rest) if rest else ('eps', '%')
 
     if t == '*':
         t_, data_ = reduce(data)
         if (t_, data_) == zero:
-            return zero
+            return ('eps', '%')
         if t_ == 'eps':
             return ('eps', '%')
         if t_ == '*':
             # e** = e*
-            return data_
+            return (t_, data_)
         if t_ == '|':
             assert data_
             # (% + e)* = e*
             if any(sub for sub in data_ if eps(sub)):
                 data__ = [sub for sub in data_ if not eps(sub)]
                 return reduce(('*', ('|', data__)))
-            return ('*', (t_, data_))
-        if t_ == '.':
-            assert data_
-            # (e.e)* = (e.e)*
-            return ('*', (t_, data_))
+        return ('*', (t_, data_))
     return (t, data)
 
 
@@ -235,18 +519,19 @@ def print_regex(ast):
     if t == '|':
         return '|'.join('%s' % print_regex(sub) for sub in data) if data else '{}'
     if t == '*':
-        return ('(%s)*' if not atomic(data) else '%s') % print_regex(data)
+        return ('(%s)*' if not atomic(data) else '%s*') % print_regex(data)
 
 
-def disambiguate(regex):
-    R, dfa, accepts, n = compile_disambiguously(regex)
-    regex = reduce(('|', [R(1, k, n) for k in accepts]))
+def disambiguate(regex, minimal = True):
+    R, dfa, accepts, n = compile_disambiguously(regex, minimal)
+    regex = reduce(eliminate(dfa, accepts, n))
     return regex
 
 
-def compile_disambiguously(regex):
+def compile_disambiguously(regex, minimal = True):
     nfa = compile(parse(regex)) if isinstance(regex, str) else compile(regex)
     dfa = determinize(nfa)
+    if minimal: dfa = minimize(dfa)
     return reconstruct(*dfa)
 
 if __name__ == '__main__':
@@ -256,9 +541,42 @@ if __name__ == '__main__':
     nfa = compile(parse("0*0*1*2*"))
     dfa = determinize(nfa)
     R, dfa, accepts, n = reconstruct(*dfa)
-    regex = reduce(('|', [R(1, k, n) for k in accepts]))
+    regex = reduce(eliminate(dfa, accepts, n))
     print(print_regex(regex))
     from regex_enumerate.enumerate import exact_coefficients, generating_function, algebraic_form
     print(list(islice(exact_coefficients(regex), 10)))
     print(generating_function(regex))
-    print(algebraic_form(regex))
\ No newline at end of file
+    print(algebraic_form(regex))
+    # Output size and time of heuristic, hash-consed state elimination against the fixed order 1..n.
+    import time
+    def tree_size(regex, memo):
+        if id(regex) not in memo:
+            t, data = regex
+            children = data if t in ('|', '.') else [data] if t == '*' else []
+            memo[id(regex)] = (regex, 1 + sum(tree_size(sub, memo) for sub in children))
+        return memo[id(regex)][1]
+    for pattern in ["(00*1)*", "(%|1|11)(00*(1|11))*0* | 1", "(000)*(111)*(22)*(33)*(44)*",
+                    "1*(22)*(333)*(4444)*(55555)*", "01*" * 5, "(01*)*", "a*b*c*(dd)*|e", "(00*1)*00*", "0|1"]:
+        R, dfa, accepts, n = compile_disambiguously(pattern)
+        start = time.time()
+        memo = {}
+        fast = reduce(eliminate(dfa, accepts, n))
+        fast_time, fast_size = time.time() - start, tree_size(fast, memo)
+        if n <= 8:
+            start = time.time()
+            slow = reduce(('|', [R(1, k, n) for k in accepts]))
+            slow = '%6d nodes in %6.3fs' % (tree_size(slow, {}), time.time() - start)
+        else:
+            slow = '%21s' % 'skipped'
+        print('%-30s %3d states: fixed order %s, heuristic %6d nodes (%5d distinct) in %6.3fs' %
+              (pattern, n, slow, fast_size, len(memo), fast_time))
+
+    # Memory footprint of the NFA representation, per state and per transition.
+    import tracemalloc
+    for pattern in ['(0|1)*1' + '(0|1)' * 200, '|'.join('01' * k for k in range(1, 200)), '(00*1)*' * 500]:
+        tracemalloc.start()
+        nfa = compile(parse(pattern))
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('%6d states %6d transitions %7.1f bytes/state %7.1f bytes/transition' %
+              (nfa.states, len(nfa), size / float(nfa.states), size / float(len(nfa))))
@@ -0,0 +1,186 @@
+import gzip
+import json
+import os
+from collections import namedtuple
+
+import numpy
+
+# A sequence that matches a query, where position is the index (within the terms listed in the dump) of the term
+# that the query starts matching at.
+Sequence = namedtuple('Sequence', ['id', 'name', 'position'])
+
+# The fixture dump that ships with the library: a small excerpt of the OEIS, in the same format as the full one.
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'oeis')
+
+LIMIT = 1 << 63
+PRIME = numpy.uint64(0x100000001b3)
+
+
+def read(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                yield line.rstrip('\n')
+
+
+def window_hashes(terms, k):
+    '''
+    Hashes every window of k consecutive terms (as int64) at once, as
+        h = ((... ((t[0] * P) ^ t[1]) * P ...) ^ t[k - 1])
+    in wrapping uint64 arithmetic.
+    :return: hashes[i] for the window starting at terms[i], for every i <= len(terms) - k
+    '''
+    terms = numpy.asarray(terms, dtype=numpy.int64).view(numpy.uint64)
+    count = len(terms) - k + 1
+    hashes = numpy.zeros(max(count, 0), dtype=numpy.uint64)
+    with numpy.errstate(over='ignore'):
+        for j in range(k):
+            hashes = (hashes * PRIME) ^ terms[j:j + count]
+    return hashes
+
+
+def build(stripped, directory, names = None, k = 4):
+    '''
+    Builds a local index of the OEIS out of its `stripped` dump (and optionally its `names` dump), from
+    https://oeis.org/stripped.gz and https://oeis.org/names.gz, either gzipped or not. The index holds
+        terms.npy      every term of every sequence, concatenated, as int64
+        offsets.npy    where the terms of each sequence start within terms.npy
+        ids.npy        the A-number of each sequence
+        hashes.npy     the hash of every window of k consecutive terms within a sequence, sorted
+        positions.npy  where each of those windows starts within terms.npy
+        names.txt      the name of each sequence, one per line, and names.npy, where each line starts
+    all of which are memory-mapped when the index is opened. A sequence is only listed up to its first
+    term that does not fit into an int64.
+    '''
+    if not os.path.isdir(directory): os.makedirs(directory)
+    ids, offsets, terms = [], [0], []
+    for line in read(stripped):
+        number, _, data = line.partition(' ')
+        for term in data.strip(',').split(','):
+            if not term: continue
+            term = int(term)
+            if not -LIMIT <= term < LIMIT: break
+            terms.append(term)
+        ids.append(int(number[1:]))
+        offsets.append(len(terms))
+    terms = numpy.array(terms, dtype=numpy.int64)
+    offsets = numpy.array(offsets, dtype=numpy.int64)
+
+    # A window is only valid if it lies within a single sequence.
+    ends = numpy.repeat(offsets[1:], numpy.diff(offsets))
+    starts = numpy.flatnonzero(numpy.arange(len(terms)) + k <= ends)
+    hashes = window_hashes(terms, k)[starts] if len(starts) else numpy.zeros(0, dtype=numpy.uint64)
+    order = numpy.argsort(hashes, kind='stable')
+
+    named = {}
+    if names:
+        for line in read(names):
+            number, _, name = line.partition(' ')
+            named[int(number[1:])] = name.replace('\n', ' ')
+    lines = [named.get(number, '').encode('utf-8') + b'\n' for number in ids]
+    with open(os.path.join(directory, 'names.txt'), 'wb') as f:
+        f.writelines(lines)
+
+    numpy.save(os.path.join(directory, 'terms.npy'), terms)
+    numpy.save(os.path.join(directory, 'offsets.npy'), offsets)
+    numpy.save(os.path.join(directory, 'ids.npy'), numpy.array(ids, dtype=numpy.int32))
+    numpy.save(os.path.join(directory, 'hashes.npy'), hashes[order])
+    numpy.save(os.path.join(directory, 'positions.npy'), starts[order].astype(numpy.int64))
+    numpy.save(os.path.join(directory, 'names.npy'), numpy.cumsum([0] + [len(line) for line in lines]))
+    with open(os.path.join(directory, 'index.json'), 'w') as f:
+        json.dump({'k': k, 'sequences': len(ids), 'terms': len(terms)}, f)
+    return Index(directory)
+
+
+class Index(object):
+    '''
+    A local, memory-mapped index of the OEIS (see build), which answers lookup_by_terms just like pyoeis's
+    OEISClient would, but without ever going over the network.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'index.json')) as f:
+            self.k = json.load(f)['k']
+        load = lambda name: numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+        self.terms, self.offsets, self.ids = load('terms'), load('offsets'), load('ids')
+        self.hashes, self.positions, self.lines = load('hashes'), load('positions'), load('names')
+
+    def name(self, s):
+        with open(os.path.join(self.directory, 'names.txt'), 'rb') as f:
+            f.seek(int(self.lines[s]))
+            return f.read(int(self.lines[s + 1] - self.lines[s])).decode('utf-8').rstrip('\n')
+
+    def candidates(self, terms):
+        if len(terms) >= self.k:
+            h = window_hashes(terms[:self.k], self.k)[0]
+            lo, hi = numpy.searchsorted(self.hashes, h, 'left'), numpy.searchsorted(self.hashes, h, 'right')
+            return numpy.sort(self.positions[lo:hi])
+        # Too short for a window, so fall back to a linear scan for the first term.
+        return numpy.flatnonzero(self.terms == terms[0]) if len(terms) else numpy.zeros(0, dtype=numpy.int64)
+
+    def lookup_by_terms(self, terms, max_seqs = 20):
+        '''
+        Finds the sequences that contain terms as a contiguous subsequence, at any position.
+        :return: a list of up to max_seqs Sequence, in the order of their A-numbers
+        '''
+        terms = [int(term) for term in terms]
+        if any(not -LIMIT <= term < LIMIT for term in terms):
+            return []
+        candidates = self.candidates(terms)
+        sequences = numpy.searchsorted(self.offsets, candidates, 'right') - 1
+        inside = candidates + len(terms) <= self.offsets[sequences + 1]
+        candidates, sequences = candidates[inside], sequences[inside]
+        if len(terms) and len(candidates):
+            # Check every candidate against the whole query at once.
+            windows = self.terms[candidates[:, None] + numpy.arange(len(terms))]
+            matches = (windows == numpy.array(terms, dtype=numpy.int64)).all(axis=1)
+            candidates, sequences = candidates[matches], sequences[matches]
+        results, seen = [], set()
+        for position, s in zip(candidates, sequences):
+            if s in seen: continue
+            seen.add(s)
+            results.append(Sequence('A%06d' % self.ids[s], self.name(s), int(position - self.offsets[s])))
+            if len(results) == max_seqs: break
+        return results
+
+
+indices = {}
+def open_index(directory):
+    '''
+    Opens (and keeps open) the index in directory, building it first if directory holds the raw dumps instead.
+    '''
+    if directory not in indices:
+        if os.path.exists(os.path.join(directory, 'index.json')):
+            indices[directory] = Index(directory)
+        else:
+            raw = lambda name: next((os.path.join(directory, name + suffix) for suffix in ('', '.gz')
+                                     if os.path.exists(os.path.join(directory, name + suffix))), None)
+            indices[directory] = build(raw('stripped'), directory, raw('names'))
+    return indices[directory]
+
+
+if __name__ == '__main__':
+    # python -m regex_enumerate.oeis stripped.gz names.gz directory builds an index out of the full dump,
+    # and otherwise, the fixture dump is indexed into a temporary directory and queried.
+    import sys
+    import tempfile
+    import time
+    from itertools import islice
+
+    if len(sys.argv) == 4:
+        start = time.time()
+        index = build(sys.argv[1], sys.argv[3], sys.argv[2])
+        print('Indexed %d sequences in %.1fs' % (len(index.ids), time.time() - start))
+        sys.exit(0)
+
+    from regex_enumerate.enumerate import exact_coefficients
+    directory = tempfile.mkdtemp()
+    index = build(os.path.join(fixture, 'stripped'), directory, os.path.join(fixture, 'names'))
+    for regex in ['(0+1)*0+', '(0|1)*', '1*(22)*(333)*', '(.)* (.....)* (..........)* (.........................)*',
+                  '(0|1)*(0|1)*', '0*1*2*']:
+        terms = list(islice(exact_coefficients(regex), 5, 16))
+        start = time.time()
+        results = index.lookup_by_terms(terms)
+        print('%-60s %6.2fms %s' % (regex, 1000 * (time.time() - start),
+                                    ', '.join('%s (at %d): %s' % (r.id, r.position, r.name) for r in results)))
@@ -1,6 +1,12 @@
-from re import compile
+class RegexSyntaxError(ValueError):
+    '''
+    Raised on malformed regular expressions, carrying the offending position within the input.
+    '''
+    def __init__(self, message, regex, position):
+        super(RegexSyntaxError, self).__init__('%s at position %d: %s' % (message, position, regex))
+        self.regex = regex
+        self.position = position
 
-x = compile(r'[^?+*()|]')
 
 def parse_regex(re, stack):
     '''
@@ -11,53 +17,69 @@ def parse_regex(re, stack):
     concats = ('.', atom)
     atom = ('tok', character) or ('eps', '%') or ('*', expr) or alternates
     A proof of correctness can be derived through structural induction on this data-scheme.
+
+    The input is consumed in a single left-to-right pass over its indices, so parsing takes
+    linear time and constant (Python) stack depth regardless of the length of the regex.
+    Spaces are ignored.
     '''
-    if not re:
-        assert len(stack) == 1
-        return stack[-1]
-    _, alternates = stack[-1] # stack of alternates
-    assert _ == '|'
-    if x.match(re):
-        curr, re = re[0], re[1:]
-        _, current_concat = alternates[-1]
-        assert _ == '.'
-        current_concat.append(('tok' if curr != '%' else 'eps', curr))
-        return parse_regex(re, stack)
-    elif re[0] == '(':
-        # push onto stack
-        stack.append(('|', [('.', [])]))
-        return parse_regex(re[1:], stack)
-    elif re[0] == ')':
-        # pop from stack
-        group = stack.pop(-1)
-        _, alternates = stack[-1]
-        assert _ == '|'
-        _, current_concat = alternates[-1]
-        assert _ == '.'
-        current_concat.append(group)
-        return parse_regex(re[1:], stack)
-    elif re[0] == '|':
-        alternates.append(('.', []))
-        return parse_regex(re[1:], stack)
-    elif re[0] == '*':
-        _, current_concat = alternates[-1]
-        assert _ == '.'
-        current_concat[-1] = ('*', current_concat[-1])
-        return parse_regex(re[1:], stack)
-    elif re[0] == '+':
-        # e+ -> ('.', e, e*)
+    # positions of the currently open parentheses, for error reporting
+    opened = []
+    for position, curr in enumerate(re):
+        if curr == ' ':
+            continue
+        _, alternates = stack[-1] # stack of alternates
         _, current_concat = alternates[-1]
-        assert _ == '.'
-        current_concat[-1] = ('.', [current_concat[-1], ('*', current_concat[-1])])
-        return parse_regex(re[1:], stack)
-    elif re[0] == '?':
-        # e? -> (e | %)
-        _, current_concat = alternates[-1]
-        assert _ == '.'
-        current_concat[-1] = ('|', [current_concat[-1], ('eps', '%')])
-        return parse_regex(re[1:], stack)
-    else:
-        raise NotImplementedError()
+        if curr not in '?+*()|':
+            current_concat.append(('tok' if curr != '%' else 'eps', curr))
+        elif curr == '(':
+            # push onto stack
+            stack.append(('|', [('.', [])]))
+            opened.append(position)
+        elif curr == ')':
+            # pop from stack
+            if len(stack) == 1:
+                raise RegexSyntaxError("Unbalanced ')'", re, position)
+            group = stack.pop(-1)
+            opened.pop(-1)
+            _, alternates = stack[-1]
+            _, current_concat = alternates[-1]
+            current_concat.append(group)
+        elif curr == '|':
+            alternates.append(('.', []))
+        else:
+            if not current_concat:
+                raise RegexSyntaxError("Nothing to repeat with '%s'" % curr, re, position)
+            if curr == '*':
+                current_concat[-1] = ('*', current_concat[-1])
+            elif curr == '+':
+                # e+ -> ('.', e, e*)
+                current_concat[-1] = ('.', [current_concat[-1], ('*', current_concat[-1])])
+            else:
+                # e? -> (e | %)
+                current_concat[-1] = ('|', [current_concat[-1], ('eps', '%')])
+    if opened:
+        raise RegexSyntaxError("Unbalanced '('", re, opened[-1])
+    return stack[-1]
+
 
 def parse(re):
-    return parse_regex(re.replace(' ', ''), [('|', [('.', [])])])
\ No newline at end of file
+    return parse_regex(re, [('|', [('.', [])])])
+
+
+if __name__ == '__main__':
+    # Throughput benchmark on long, generated regexes.
+    import time
+
+    patterns = {
+        'flat alternation': '|'.join('0' * (k % 7 + 1) for k in range(10000)),
+        'nested groups': '(' * 2000 + '0|1' + ')*' * 2000,
+        'concatenation': '01*' * 20000,
+        'postfix-heavy': '(0+1?)*' * 10000,
+    }
+    for name, pattern in sorted(patterns.items()):
+        repeats = 5
+        start = time.time()
+        for _ in range(repeats):
+            parse(pattern)
+        elapsed = (time.time() - start) / repeats
+        print('%-18s %8d chars %10.0f chars/s' % (name, len(pattern), len(pattern) / elapsed))
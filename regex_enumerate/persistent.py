@@ -0,0 +1,192 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from fractions import Fraction
+
+from regex_enumerate import profiling
+from regex_enumerate.version import __version__
+
+# The cache directory, or None to not persist anything. Set through use(), or the REGEX_ENUMERATE_CACHE variable.
+directory = None
+# The cache directory is trimmed back down to this many bytes whenever it outgrows them.
+maxbytes = 256 << 20
+# The size of the directory as of its last scan, plus whatever this process wrote into it since (or None before the
+# first scan). Other processes' writes are only seen by the next scan, which only runs once this goes over maxbytes.
+estimate = None
+
+MAGIC = b'RXEC'
+# The kinds of arrays an entry can hold, with the numbers that fit each of them.
+INT64, FLOAT64, COMPLEX128, TEXT = 'i8', 'f8', 'c16', 'text'
+
+
+def use(path, size = None):
+    '''
+    Persists the rational forms and partial fractions of every compiled regex into the cache directory path,
+    and reuses whatever is already in there, even when other processes are writing into it concurrently.
+    :param size: the most bytes that the directory may hold before its least recently used entries are evicted
+    '''
+    global directory, maxbytes, estimate
+    directory, estimate = path, None
+    if size is not None: maxbytes = size
+    if path and not os.path.isdir(path): os.makedirs(path)
+
+
+def key(*parts):
+    '''
+    A content address for the parts, within this version of the library.
+    '''
+    return hashlib.sha1(json.dumps([__version__] + list(parts)).encode('utf-8')).hexdigest()
+
+
+def fetch(address, compute):
+    '''
+    Returns the entry at address, or computes it (as a dict from names to lists of numbers) and stores it first.
+    '''
+    if not directory:
+        return compute()
+    path = os.path.join(directory, address[:2], address[2:])
+    try:
+        fields = load(path)
+        profiling.count('persistent hits')
+        # Keep the modification times in least recently used order for evict.
+        os.utime(path, None)
+        return fields
+    except (IOError, OSError, ValueError, struct.error):
+        profiling.count('persistent misses')
+        fields = compute()
+        try:
+            grown(save(path, fields))
+        except (IOError, OSError):
+            pass
+        return fields
+
+
+def kind(values):
+    import numpy
+    if any(isinstance(value, complex) for value in values):
+        return COMPLEX128
+    if any(isinstance(value, Fraction) for value in values):
+        return TEXT
+    if all(isinstance(value, (int, numpy.integer)) for value in values):
+        return INT64 if all(-(1 << 63) <= value < (1 << 63) for value in values) else TEXT
+    if all(not isinstance(value, (int, numpy.integer)) or abs(value) < (1 << 53) for value in values):
+        return FLOAT64
+    return TEXT
+
+
+def save(path, fields):
+    '''
+    Writes an entry as a JSON header, of the kind, offset and length of each array, followed by the arrays as
+    packed little-endian data (or, for integers that do not fit into an int64 and fractions, as text). The file is
+    written aside and then atomically renamed into place, so concurrent readers never see a partial entry.
+    :return: the size of the entry, in bytes
+    '''
+    import numpy
+    header, chunks, offset = {}, [], 0
+    for name, values in sorted(fields.items()):
+        values = [complex(value) if isinstance(value, numpy.complexfloating) else value for value in values]
+        t = kind(values)
+        if t == TEXT:
+            text = (str(value) if isinstance(value, Fraction) else repr(value) for value in values)
+            data = ','.join(text).encode('ascii')
+        else:
+            data = numpy.array(values, dtype='<' + t).tobytes()
+        header[name] = (t, offset, len(data))
+        chunks.append(data)
+        offset += len(data)
+    head = json.dumps(header).encode('utf-8')
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder): raise
+    handle, temporary = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(head)) + head)
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary): os.remove(temporary)
+        raise
+    return 8 + len(head) + offset
+
+
+def load(path):
+    '''
+    Reads an entry back through a memory map, so that only the header is parsed and the packed arrays are decoded
+    without going through text. The arrays are still copied out into lists of Python numbers, since the polynomials
+    of the library need exact Python ints (and the map is closed once the entry is read), so nothing stays zero-copy.
+    '''
+    import numpy
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if data[:4] != MAGIC: raise ValueError('Not a cache entry: %s' % path)
+        length, = struct.unpack('<I', data[4:8])
+        header = json.loads(data[8:8 + length].decode('utf-8'))
+        start = 8 + length
+        fields = {}
+        for name, (t, offset, size) in header.items():
+            if t == TEXT:
+                text = data[start + offset:start + offset + size].decode('ascii')
+                fields[name] = [int(value) if value.lstrip('-').isdigit() else Fraction(value) if '/' in value
+                                else float(value) for value in text.split(',')] if text else []
+            else:
+                fields[name] = numpy.frombuffer(data, dtype='<' + t, count=size // numpy.dtype(t).itemsize,
+                                                offset=start + offset).tolist()
+        return fields
+    finally:
+        data.close()
+
+
+def grown(size):
+    '''
+    Accounts for a new entry of size bytes, and only scans the directory (see evict) when it may have outgrown
+    maxbytes, so that writes do not pay for listing the whole directory.
+    '''
+    global estimate
+    if estimate is None or estimate + size > maxbytes:
+        evict()
+    else:
+        estimate += size
+
+
+def evict():
+    '''
+    Deletes the least recently used entries until the directory is back down to 3/4 of maxbytes. Entries that
+    another process evicts (or replaces) in the meantime are simply skipped, and so are the temporary files of
+    entries that are still being written.
+    '''
+    global estimate
+    entries, total = [], 0
+    for folder in os.listdir(directory):
+        folder = os.path.join(directory, folder)
+        if not os.path.isdir(folder): continue
+        for name in os.listdir(folder):
+            if name.endswith('.tmp'): continue
+            try:
+                stat = os.stat(os.path.join(folder, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(folder, name)))
+            total += stat.st_size
+    estimate = total
+    if total <= maxbytes: return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        estimate = total
+        if total <= maxbytes * 3 // 4: break
+
+
+if os.environ.get('REGEX_ENUMERATE_CACHE'):
+    use(os.environ['REGEX_ENUMERATE_CACHE'])
@@ -0,0 +1,106 @@
+import functools
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# The report that is currently being recorded into, or None when profiling is off. Every hook checks this first,
+# so that instrumented code only pays for a global lookup while nothing is being profiled.
+active = None
+
+
+class Report(object):
+    '''
+    What a profiling session (see profile) recorded:
+        seconds   the wall time spent in each stage of the pipeline, where nested calls of a stage count once
+        calls     the number of (outermost) calls into each stage
+        counts    event counters, e.g. the number of polynomial multiplications, or of memo hits and misses
+        maxima    the largest values seen, e.g. the highest polynomial degree or the most DFA states
+    '''
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counts = defaultdict(int)
+        self.maxima = {}
+        self.depth = defaultdict(int)
+
+    def hit_rates(self):
+        '''
+        The fraction of lookups that hit, for every memo that counted both '<memo> hits' and '<memo> misses'.
+        '''
+        rates = {}
+        for name in self.counts:
+            if name.endswith(' hits'):
+                memo = name[:-len(' hits')]
+                total = self.counts[name] + self.counts.get(memo + ' misses', 0)
+                rates[memo] = self.counts[name] / float(total) if total else 0.0
+        return rates
+
+    def as_dict(self):
+        return {
+            'stages': dict((stage, {'seconds': self.seconds[stage], 'calls': self.calls[stage]})
+                           for stage in self.seconds),
+            'counts': dict(self.counts),
+            'maxima': dict(self.maxima),
+            'hit_rates': self.hit_rates(),
+        }
+
+    def __str__(self):
+        lines = ['%-28s %10.4fs %8d calls' % (stage, seconds, self.calls[stage])
+                 for stage, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])]
+        lines += ['%-28s %10d' % item for item in sorted(self.counts.items())]
+        lines += ['%-28s %10d (max)' % item for item in sorted(self.maxima.items())]
+        lines += ['%-28s %10.1f%% hits' % (memo, 100 * rate) for memo, rate in sorted(self.hit_rates().items())]
+        return '\n'.join(lines)
+
+
+@contextmanager
+def profile():
+    '''
+    Records what the library does within the block into a Report:
+
+        with profile() as report:
+            algebraic_form('(0+1)*0+')
+        print(report)
+
+    Sessions do not nest: an inner session takes over until it ends.
+    '''
+    global active
+    previous, active = active, Report()
+    try:
+        yield active
+    finally:
+        active = previous
+
+
+def count(name, amount = 1):
+    if active is not None:
+        active.counts[name] += amount
+
+
+def maximum(name, value):
+    if active is not None and value > active.maxima.get(name, value - 1):
+        active.maxima[name] = value
+
+
+def timed(stage):
+    '''
+    Decorates a function so that its calls are timed as stage whenever a profiling session is active.
+    '''
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            report = active
+            if report is None:
+                return f(*args, **kwargs)
+            report.depth[stage] += 1
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                report.depth[stage] -= 1
+                # Recursive (or otherwise nested) calls are already covered by the outermost one.
+                if not report.depth[stage]:
+                    report.seconds[stage] += time.perf_counter() - start
+                    report.calls[stage] += 1
+        return wrapper
+    return decorate
@@ -0,0 +1,405 @@
+import math
+from fractions import Fraction
+from itertools import islice
+
+from regex_enumerate.enumerate import counted, exact_coefficients, exact_many, rational_coefficients
+from regex_enumerate.profiling import timed
+from regex_enumerate.transfer import is_prime, rational
+
+# The number theoretic transforms run modulo primes of the form c * 2**17 + 1 below 2**31, whose multiplicative
+# groups have elements of order 2**17, so that they support transforms of up to 2**17 points. Since the primes fit
+# into 31 bits, the product of any two residues fits into an int64.
+ORDER = 17
+ntt_primes = []
+roots = {}
+# Garner's algorithm costs O(P**2) per count over P primes, while stepping the recurrence costs O(deg) big integer
+# operations per count. Beyond this many primes (i.e. counts of a few hundred bits), the exact counts are stepped.
+STEPPED_PRIMES = 8
+
+
+def primitive_root(prime):
+    factors, m, f = [], prime - 1, 2
+    while f * f <= m:
+        if not m % f:
+            factors.append(f)
+            while not m % f:
+                m //= f
+        f += 1
+    if m > 1: factors.append(m)
+    g = 2
+    while any(pow(g, (prime - 1) // f, prime) == 1 for f in factors):
+        g += 1
+    return g
+
+
+def transformable(modulus):
+    '''
+    Whether the transform can run modulo modulus itself, i.e. if it is a prime of the form c * 2**17 + 1.
+    '''
+    if modulus not in roots:
+        if (modulus - 1) % (1 << ORDER) or not is_prime(modulus): return False
+        roots[modulus] = primitive_root(modulus)
+    return True
+
+
+def nth_ntt_prime(i):
+    '''
+    The i-th largest prime of the form c * 2**17 + 1 below 2**31 (of which there are several hundred).
+    '''
+    while len(ntt_primes) <= i:
+        c = (ntt_primes[-1] >> ORDER) - 1 if ntt_primes else (1 << (31 - ORDER)) - 1
+        while c > 0 and not transformable((c << ORDER) + 1):
+            c -= 1
+        if c <= 0: raise OverflowError('Ran out of primes for the number theoretic transform.')
+        ntt_primes.append((c << ORDER) + 1)
+    return ntt_primes[i]
+
+
+twiddles = {}
+def twiddle(prime, n, invert):
+    '''
+    The bit-reversal permutation of n points, and the powers w**0, ..., w**(n/2 - 1) of a primitive n-th root of unity w
+    (or of its inverse) modulo prime.
+    '''
+    import numpy
+    key = (prime, n, invert)
+    if key not in twiddles:
+        bits = n.bit_length() - 1
+        indices = numpy.arange(n)
+        reverse = numpy.zeros(n, dtype=numpy.int64)
+        for b in range(bits):
+            reverse |= ((indices >> b) & 1) << (bits - 1 - b)
+        w = pow(roots[prime], (prime - 1) // n, prime)
+        if invert: w = pow(w, prime - 2, prime)
+        powers = numpy.ones(max(n // 2, 1), dtype=numpy.int64)
+        filled = 1
+        while filled < n // 2:
+            step = min(filled, n // 2 - filled)
+            powers[filled:filled + step] = powers[:step] * pow(w, filled, prime) % prime
+            filled += step
+        twiddles[key] = (reverse, powers)
+    return twiddles[key]
+
+
+def ntt(a, prime, invert = False):
+    '''
+    The iterative radix-2 number theoretic transform of a (whose length is a power of 2) modulo prime, where each of
+    the log(n) butterfly stages is a handful of in-place vectorized operations over the whole array.
+    '''
+    n = len(a)
+    reverse, powers = twiddle(prime, n, invert)
+    a = a[reverse]
+    length = 2
+    while length <= n:
+        half = length // 2
+        blocks = a.reshape(-1, length)
+        u, v = blocks[:, :half], blocks[:, half:]
+        v *= powers[::n // length]
+        v %= prime
+        # (u, v) <- (u + v, u - v), where both stay within [0, prime).
+        v -= u
+        v *= -1
+        v += prime * (v < 0)
+        u += u
+        u -= v
+        u -= prime * (u >= prime)
+        u += prime * (u < 0)
+        length *= 2
+    if invert:
+        a *= pow(n, prime - 2, prime)
+        a %= prime
+    return a
+
+
+def multiplier(b, modulus, n):
+    '''
+    Multiplies power series by b modulo modulus, over n coefficients (a power of 2 no larger than 2**17, which the
+    products have to fit into). The transforms of b are only taken once, so that multiplying many series by the same
+    b, e.g. by the inverse of the denominator in blocks, only takes two transforms each. A modulus that supports the
+    transform (see transformable) only takes a single one; any other modulus below 2**31 takes three, since every
+    coefficient of the exact product of residues is below 2**17 * 2**62 < 2**81, which the three recover by the
+    Chinese remainder theorem (in Garner's mixed radix form, so that every step fits into an int64).
+    :return: a function of a, for the first size coefficients of a * b modulo modulus
+    '''
+    import numpy
+    primes = [modulus] if transformable(modulus) else [nth_ntt_prime(i) for i in range(3)]
+    pad = lambda a, prime: numpy.concatenate((a % prime, numpy.zeros(n - len(a), dtype=numpy.int64)))
+    transforms = [ntt(pad(b[:n], prime), prime) for prime in primes]
+
+    def multiply(a, size):
+        images = []
+        for prime, fb in zip(primes, transforms):
+            fa = ntt(pad(a[:n], prime), prime)
+            fa *= fb
+            fa %= prime
+            images.append(ntt(fa, prime, invert=True)[:size])
+        if len(images) == 1:
+            return images[0]
+        (p, q, r), (x, y, z) = primes, images
+        # value = x + p * s + p * q * t, where 0 <= s < q and 0 <= t < r
+        s = (y - x) % q * pow(p, q - 2, q) % q
+        t = ((z - x) % r * pow(p, r - 2, r) % r - s) % r * pow(q, r - 2, r) % r
+        return (x + p * s % modulus + (p * q % modulus) * t) % modulus
+    return multiply
+
+
+def multiply(a, b, modulus, size):
+    '''
+    The first size coefficients of the product of the power series a and b modulo modulus.
+    '''
+    import numpy
+    a, b = a[:size], b[:size]
+    n = 1
+    while n < len(a) + len(b) - 1:
+        n *= 2
+    product = multiplier(b, modulus, n)(a, size) if len(a) and len(b) else numpy.zeros(0, dtype=numpy.int64)
+    return numpy.concatenate((product, numpy.zeros(size - len(product), dtype=numpy.int64)))
+
+
+@timed('series inversion')
+def invert(f, size, modulus):
+    '''
+    The first size coefficients of 1/f modulo modulus, by Newton's iteration g <- g (2 - f g), which doubles the
+    number of correct coefficients of g at every step, for O(size log(size)) time overall.
+    '''
+    import numpy
+    g = numpy.array([pow(int(f[0]), -1, modulus)], dtype=numpy.int64)
+    known = 1
+    while known < size:
+        known = min(2 * known, size)
+        error = (-multiply(f, g, modulus, known)) % modulus
+        error[0] = (error[0] + 2) % modulus
+        g = multiply(g, error, modulus, known)
+    return g
+
+
+def residues(coefficients, modulus):
+    '''
+    The exact coefficients, as an array of residues modulo modulus.
+    '''
+    import numpy
+    values = []
+    for c in coefficients:
+        c = Fraction(c)
+        if math.gcd(c.denominator, modulus) != 1:
+            raise ZeroDivisionError('%s is not invertible modulo %d' % (c.denominator, modulus))
+        values.append(c.numerator * pow(c.denominator, -1, modulus) % modulus)
+    return numpy.array(values, dtype=numpy.int64)
+
+
+def blocks(overflow, top, bottom, N, modulus, block):
+    '''
+    Streams the coefficients of overflow(z) + top(z)/bottom(z) modulo modulus, block coefficients at a time, in
+    O(N log(block)) time overall. Only the inverse of bottom modulo z**block is computed by Newton's iteration.
+    Past the first block, the tail of the series from any n on (beyond the degree of top) is itself
+        r(z)/bottom(z), where r[j] = -(sum over i > j of bottom[i] a[n + j - i])
+    which only depends on the last deg(bottom) coefficients, so each further block is just r times the inverse.
+    '''
+    top, bottom = residues(top.coefficients, modulus), residues(bottom.coefficients, modulus)
+    overflow = residues(overflow.coefficients, modulus)
+    d = len(bottom) - 1
+    inverse = invert(bottom, block, modulus)
+    times_inverse = multiplier(inverse, modulus, transform_size(block))
+    series = times_inverse(top, block)
+    for start in range(0, N, block):
+        if start:
+            r = multiply(bottom, series[block - d:], modulus, 2 * d)[d:] if d else series[:0]
+            series = times_inverse((-r) % modulus, block)
+        values = series.copy()
+        values[:max(0, min(len(overflow) - start, block))] += overflow[start:start + block]
+        yield values[:min(block, N - start)] % modulus
+
+
+def transform_size(block):
+    # The products of blocks with the inverse (or with the remainders r, of lower degree) fit into twice the block.
+    n = 1
+    while n < 2 * block:
+        n *= 2
+    return n
+
+
+def exactly(compiled):
+    overflow, (top, bottom) = compiled.rational
+    # Without transfer.exact_arithmetic, the rational form has to be recovered from its floating point coefficients.
+    exact = [p if rational(p) else rational_coefficients(p) for p in (overflow, top, bottom)]
+    if any(p is None for p in exact):
+        raise ValueError('The rational form of %r has inexact coefficients.' % compiled.regex)
+    if not exact[2][0]:
+        raise ZeroDivisionError('The generating function of %r is not a power series.' % compiled.regex)
+    return exact
+
+
+def coefficients_array(regex, N, modulus = None, path = None, what = None, safe = False, block = 1 << 16):
+    '''
+    Computes the number of words of every size n = 0, 1, ..., N - 1 in one pass, by inverting the denominator of the
+    rational form as a power series (see blocks) with fast multiplication by number theoretic transforms. Modulo a
+    prime, this takes O(N log N) time rather than stepping through the recurrence term by term.
+    :param modulus: None to compute the counts exactly, or any modulus below 2**31 to compute them modulo modulus.
+                    Exact counts of B bits take P = O(B) primes, whose residues are stitched together by the Chinese
+                    remainder theorem in O(N (P log N + P**2)) time. That only pays off for counts that grow
+                    polynomially, so counts that need more than STEPPED_PRIMES primes (e.g. of languages that grow
+                    exponentially, where B = O(N)) are stepped out of the linear recurrence instead (see stepped).
+    :param path: a .npy file to stream the counts into, one block at a time, so that they never need to fit in memory.
+                 The file is memory-mapped, and returned as such. Without one, the counts are returned as an array.
+    :return: an int64 array of the N counts, or, when they do not all fit into an int64, an (N, limbs) uint32 array of
+             their little-endian base 2**32 digits (see to_int)
+    '''
+    import numpy
+    compiled = counted(regex, what, safe)
+    overflow, top, bottom = exactly(compiled)
+    # Past the first block, every block has to start beyond the numerator and the overflow.
+    block = max(min(block, N), len(top.coefficients), len(overflow.coefficients), len(bottom.coefficients))
+    if transform_size(block) > 1 << ORDER:
+        raise ValueError('Blocks of %d coefficients are too large for the transform.' % block)
+
+    if modulus is not None:
+        if not 1 < modulus < 1 << 31:
+            raise ValueError('The modulus has to be between 2 and 2**31.')
+        output = allocate(path, numpy.int64, (N,))
+        for start, values in zip(range(0, N, block), blocks(overflow, top, bottom, N, modulus, block)):
+            output[start:start + len(values)] = values
+        return finish(output)
+
+    # The largest counts are among the last ones, barring cancellation, but one more prime checks the result.
+    sample = range(max(0, N - len(bottom.coefficients) - 1), N)
+    bits = max([abs(int(count)).bit_length() for count in exact_many(compiled, sample)] + [1]) + 16
+    while True:
+        if bits > 31 * STEPPED_PRIMES:
+            output = stepped(compiled, N, block, bits, path)
+        else:
+            output = reconstruct(overflow, top, bottom, N, block, bits, path)
+        if output is not None: return output
+        bits *= 2
+
+
+def allocate(path, dtype, shape):
+    import numpy
+    if path is None:
+        return numpy.zeros(shape, dtype=dtype)
+    return numpy.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+def finish(output):
+    import numpy
+    if isinstance(output, numpy.memmap): output.flush()
+    return output
+
+
+@timed('chinese remainders')
+def reconstruct(overflow, top, bottom, N, block, bits, path):
+    '''
+    Computes the counts modulo enough primes to hold bits bits (plus one more prime to check the result with), and
+    reconstructs them by the Chinese remainder theorem, in Garner's mixed radix form: each count is
+        x[0] + p[0] (x[1] + p[1] (x[2] + ...))
+    where 0 <= x[i] < p[i], which is evaluated in base 2**32 over all of the counts of a block at once.
+    :return: the counts (see coefficients_array), or None if they turn out to need more bits
+    '''
+    import numpy
+    primes, modulus, i = [], 1, 0
+    denominators = [Fraction(c).denominator for p in (overflow, top, bottom) for c in p.coefficients]
+    while modulus.bit_length() <= bits + 1:
+        prime = nth_ntt_prime(i)
+        i += 1
+        if any(not d % prime for d in denominators): continue
+        primes.append(prime)
+        modulus *= prime
+    while True:
+        check = nth_ntt_prime(i)
+        i += 1
+        if not any(not d % check for d in denominators): break
+
+    limbs = (bits + 31) // 32
+    wide = limbs > 2
+    output = allocate(path, numpy.uint32 if wide else numpy.int64, (N, limbs) if wide else (N,))
+    streams = [blocks(overflow, top, bottom, N, p, block) for p in primes]
+    checks = blocks(overflow, top, bottom, N, check, block)
+    for start in range(0, N, block):
+        images = [next(stream) for stream in streams]
+        expected = next(checks)
+        # Garner's algorithm, one prime at a time, over the whole block.
+        digits = []
+        for j, (p, image) in enumerate(zip(primes, images)):
+            x = image
+            for q, digit in zip(primes[:j], digits):
+                x = (x - digit) % p * pow(q, p - 2, p) % p
+            digits.append(x)
+        # Evaluate the mixed radix form modulo the check prime, and in base 2**32.
+        residue = numpy.zeros(len(expected), dtype=numpy.int64)
+        value = numpy.zeros((len(expected), limbs + 1), dtype=numpy.uint64)
+        for p, digit in reversed(list(zip(primes, digits))):
+            residue = (residue * (p % check) + digit) % check
+            carry = digit.astype(numpy.uint64)
+            for limb in range(limbs + 1):
+                total = value[:, limb] * numpy.uint64(p) + carry
+                value[:, limb] = total & numpy.uint64(0xffffffff)
+                carry = total >> numpy.uint64(32)
+        if (residue != expected).any() or value[:, limbs].any():
+            return None
+        if wide:
+            output[start:start + len(expected)] = value[:, :limbs].astype(numpy.uint32)
+        else:
+            low = value[:, 0] | (value[:, 1] << numpy.uint64(32)) if limbs > 1 else value[:, 0]
+            if (low >> numpy.uint64(63)).any():
+                return None
+            output[start:start + len(expected)] = low.astype(numpy.int64)
+    return finish(output)
+
+
+@timed('stepped')
+def stepped(compiled, N, block, bits, path):
+    '''
+    Steps the exact counts out of the linear recurrence of the rational form (see exact_coefficients), and writes them
+    out block rows at a time, in O(N deg) big integer operations.
+    :return: the counts (see coefficients_array), or None if they turn out to need more bits
+    '''
+    import numpy
+    limbs = (bits + 31) // 32
+    wide = limbs > 2
+    output = allocate(path, numpy.uint32 if wide else numpy.int64, (N, limbs) if wide else (N,))
+    counts = exact_coefficients(compiled)
+    for start in range(0, N, block):
+        chunk = list(islice(counts, min(block, N - start)))
+        if any(count.bit_length() > (32 * limbs if wide else 63) for count in chunk):
+            return None
+        if wide:
+            rows = b''.join(count.to_bytes(4 * limbs, 'little') for count in chunk)
+            output[start:start + len(chunk)] = numpy.frombuffer(rows, dtype='<u4').reshape(len(chunk), limbs)
+        else:
+            output[start:start + len(chunk)] = numpy.array(chunk, dtype=numpy.int64)
+    return finish(output)
+
+
+def to_int(limbs):
+    '''
+    Reads a count back out of a row of the (N, limbs) array that coefficients_array returns for large counts.
+    '''
+    import numpy
+    return int.from_bytes(numpy.asarray(limbs, dtype='<u4').tobytes(), 'little')
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import time
+    from itertools import islice
+    from regex_enumerate.enumerate import exact_coefficients
+
+    for regex in ['(0+1)*0+', '1*(22)*(333)*(4444)*(55555)*', '(0|1)*(0|1)*', '(00*1)*00*', '01*' * 5]:
+        expected = list(islice(exact_coefficients(regex), 300))
+        counts = coefficients_array(regex, 300)
+        counts = [to_int(row) for row in counts] if counts.ndim == 2 else [int(c) for c in counts]
+        modular = coefficients_array(regex, 300, modulus=10 ** 9 + 7)
+        assert counts == expected, regex
+        assert [int(c) for c in modular] == [c % (10 ** 9 + 7) for c in expected], regex
+        print('%-30s agrees with exact_coefficients up to n = 300' % regex)
+
+    # All of the counts up to a million, streamed into a file.
+    directory = tempfile.mkdtemp()
+    for regex, modulus in [('1*(22)*(333)*(4444)*(55555)*', None), ('(0+1)*0+', 998244353), ('(0+1)*0+', 10 ** 9 + 7)]:
+        start = time.time()
+        path = os.path.join(directory, 'counts.npy')
+        counts = coefficients_array(regex, 10 ** 6, modulus=modulus, path=path)
+        print('%-30s %-10s n < 10**6 in %.2fs, a[999999] = %s' % (
+            regex, modulus, time.time() - start, counts[-1] if counts.ndim == 1 else to_int(counts[-1])))
+        del counts
+        os.remove(path)
@@ -1,8 +1,16 @@
-from collections import defaultdict
+import math
+from fractions import Fraction
 
 from regex_enumerate.parse import parse
+from regex_enumerate import profiling
+from regex_enumerate.profiling import timed
 
+# Whether simplify reduces rational forms with exact (integer or rational) coefficients exactly. Setting this to False
+# opts back into the floating point Euclid, which is cheaper for small forms, but may leave common factors behind.
+exact_arithmetic = True
 
+
+@timed('transfer')
 def transfer(regex, what = None):
     '''
     Transfers a regular expression into a rational complex function (repr)
@@ -15,25 +23,28 @@ def transfer(regex, what = None):
     :return: rational function
     '''
     ast = parse(regex) if isinstance(regex, str) else regex
+    # Regex trees may share subexpressions (see nfa.eliminate), so memoize on node identity.
+    memo = {}
 
     def helper(ast):
+        if id(ast) not in memo:
+            memo[id(ast)] = (ast, translate(ast))
+        return memo[id(ast)][1]
+
+    def translate(ast):
         t, data = ast
         if t == '|':
             if len(data) == 0:
                 return ('num', 0)
             if len(data) == 1:
                 return helper(data[0])
-            if len(data) == 2:
-                return ('+', [helper(data[0]), helper(data[1])])
-            return ('+', [helper(data[0]), helper((t, data[1:]))])
+            return ('+', [helper(sub) for sub in data])
         if t == '.':
             if len(data) == 0:
                 return ('num', 1)
             if len(data) == 1:
                 return helper(data[0])
-            if len(data) == 2:
-                return ('*', [helper(data[0]), helper(data[1])])
-            return ('*', [helper(data[0]), helper((t, data[1:]))])
+            return ('*', [helper(sub) for sub in data])
         if t == 'tok':
             return ('var', 'z') if not what or data in what else ('num', 1)
         if t == 'eps':
@@ -64,6 +75,7 @@ def debug_print(ast):
     raise Exception("IllegalState")
 
 
+@timed('rationalize')
 def rationalize(ast):
     '''
     Rationalizes a rational function into a pair of numerators and denominators.
@@ -72,33 +84,40 @@ def rationalize(ast):
     :return: A pair of polynomials that forms the rational function.
     '''
 
-    (_, p), (_, q) = down_r(ast)
+    (_, p), (_, q) = down_r(ast, {})
     return process(p), process(q)
 
 
-def down_r(ast):
+def down_r(ast, memo = None):
+    # Shared subexpressions are rationalized only once.
+    if memo is None: memo = {}
+    if id(ast) not in memo:
+        memo[id(ast)] = (ast, down_r_node(ast, lambda sub: down_r(sub, memo)))
+    return memo[id(ast)][1]
+
+
+def down_r_node(ast, down_r):
     t, data = ast
     if t == 'var':
-        return ('v', {1: 1}), ('v', {0: 1})
+        return ('v', Polynomial([0, 1])), ('v', Polynomial([1]))
     if t == 'num':
-        return ('v', {0: data}), ('v', {0: 1})
+        return ('v', Polynomial([data])), ('v', Polynomial([1]))
     if t == '-':
         n, d = down_r(data)
         n_ = down_p(('-', n))
         return n_, d
     if t == '+':
-        assert len(data) == 2
-        n1, d1 = down_r(data[0])
-        n2, d2 = down_r(data[1])
-        n3 = down_p(('+', [('*', [n1, d2]), ('*', [n2, d1])]))
-        d3 = down_p(('*', [d1, d2]))
-        return n3, d3
+        # Sum the numerators of terms that share a denominator first (e.g. every literal in an alternation
+        # sits over 1), and then bring the distinct denominators together over their lcm (see add_r).
+        groups = {}
+        for n, d in map(down_r, data):
+            key = tuple(d[1].coefficients)
+            groups[key] = (down_p(('+', [groups[key][0], n])), d) if key in groups else (n, d)
+        return balanced(list(groups.values()), add_r)
     if t == '*':
-        assert len(data) == 2
-        n1, d1 = down_r(data[0])
-        n2, d2 = down_r(data[1])
-        n3 = down_p(('*', [n1, n2]))
-        d3 = down_p(('*', [d1, d2]))
+        terms = list(map(down_r, data))
+        n3 = balanced([n for n, _ in terms], lambda n1, n2: down_p(('*', [n1, n2])))
+        d3 = balanced([d for _, d in terms], lambda d1, d2: down_p(('*', [d1, d2])))
         return n3, d3
     if t == '/':
         assert len(data) == 2
@@ -110,6 +129,34 @@ def down_r(ast):
     raise Exception("IllegalState")
 
 
+def add_r(r1, r2):
+    (n1, d1), (n2, d2) = r1, r2
+    if d1 == d2:
+        return down_p(('+', [n1, n2])), d1
+    # n1/d1 + n2/d2 = (n1 c1 + n2 c2)/lcm, where lcm = d1 c1 = d2 c2. Exact denominators that share a factor
+    # (e.g. 1 - z**2 and 1 - z**4) are divided by their gcd, so that the degree stays close to the reduced one.
+    c1, c2 = d2, d1
+    if exact_arithmetic and rational(d1[1]) and rational(d2[1]):
+        g = gcd_integral(primitive(d1[1]), primitive(d2[1]))
+        if g.degree > 0:
+            c1, c2 = ('v', divide_exactly(d2[1], g)[0]), ('v', divide_exactly(d1[1], g)[0])
+    n3 = down_p(('+', [('*', [n1, c1]), ('*', [n2, c2])]))
+    d3 = down_p(('*', [d1, c1]))
+    return n3, d3
+
+
+def balanced(terms, combine):
+    '''
+    Folds a list of terms with combine as a balanced binary tree rather than a chain, so that
+    the two operands of each step have comparable degrees and the number of steps that touch
+    a high-degree intermediate is logarithmic rather than linear.
+    '''
+    while len(terms) > 1:
+        terms = [combine(terms[i], terms[i + 1]) if i + 1 < len(terms) else terms[i]
+                 for i in range(0, len(terms), 2)]
+    return terms[0]
+
+
 def down_p(ast):
     t, data = ast
     if t == 'v':
@@ -129,80 +176,201 @@ def down_p(ast):
     raise Exception("IllegalState")
 
 
+class Polynomial(object):
+    '''
+    A dense univariate polynomial, stored as the contiguous list of its coefficients in
+    increasing order of power, with trailing zeros trimmed so that the degree is always
+    len(coefficients) - 1. Coefficients are plain Python numbers, so integer polynomials
+    stay exact no matter how large their coefficients grow.
+
+    For compatibility with code that treats polynomials as {power: coeff} dicts, it also
+    behaves as a read-only mapping over its non-zero terms.
+    '''
+    __slots__ = ('coefficients',)
+
+    def __init__(self, coefficients = ()):
+        if isinstance(coefficients, Polynomial):
+            coefficients = coefficients.coefficients
+        elif isinstance(coefficients, dict):
+            dense = [0] * (max(coefficients) + 1 if coefficients else 0)
+            for power, coefficient in coefficients.items():
+                dense[power] += coefficient
+            coefficients = dense
+        coefficients = list(coefficients)
+        while coefficients and not coefficients[-1]:
+            coefficients.pop()
+        self.coefficients = coefficients
+
+    @property
+    def degree(self):
+        return len(self.coefficients) - 1
+
+    def __getitem__(self, power):
+        return self.coefficients[power] if 0 <= power < len(self.coefficients) else 0
+
+    def get(self, power, default = 0):
+        return self.coefficients[power] if power in self else default
+
+    def __contains__(self, power):
+        return 0 <= power < len(self.coefficients) and bool(self.coefficients[power])
+
+    def __iter__(self):
+        return (power for power, coefficient in enumerate(self.coefficients) if coefficient)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [coefficient for coefficient in self.coefficients if coefficient]
+
+    def items(self):
+        return [(power, coefficient) for power, coefficient in enumerate(self.coefficients) if coefficient]
+
+    def __len__(self):
+        return len(self.values())
+
+    def __bool__(self):
+        return bool(self.coefficients)
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            other = Polynomial(other)
+        if not isinstance(other, Polynomial):
+            return NotImplemented
+        return self.coefficients == other.coefficients
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Polynomial(%r)' % self.coefficients
+
+    def __add__(self, other):
+        p, q = self.coefficients, other.coefficients
+        if len(p) < len(q): p, q = q, p
+        r = list(p)
+        for power, coefficient in enumerate(q):
+            r[power] += coefficient
+        return Polynomial(r)
+
+    def __neg__(self):
+        return Polynomial([-coefficient for coefficient in self.coefficients])
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __mul__(self, other):
+        p, q = self.coefficients, other.coefficients
+        if not p or not q: return Polynomial()
+        if len(p) < len(q): p, q = q, p
+        r = [0] * (len(p) + len(q) - 1)
+        # Loop over the shorter factor, and accumulate a scaled copy of the longer one.
+        for i, a in enumerate(q):
+            if not a: continue
+            for j, b in enumerate(p):
+                r[i + j] += a * b
+        return Polynomial(r)
+
+    def scale(self, constant):
+        return Polynomial([constant * coefficient for coefficient in self.coefficients])
+
+
 def add(v1, v2):
     t1, d1 = v1
     t2, d2 = v2
     assert t1 == t2 == 'v'
-    d3 = defaultdict(int)
-    for p, n in d1.items():
-        d3[p] += n
-    for p, n in d2.items():
-        d3[p] += n
-    return 'v', process(dict(d3))
+    return 'v', process(d1 + d2)
 
 
 def neg(v):
     t, d = v
     assert t == 'v'
-    d2 = {}
-    for p, n in d.items():
-        d2[p] = -n
-    return 'v', process(d2)
+    return 'v', process(-d)
 
 
 def mul(v1, v2):
     t1, d1 = v1
     t2, d2 = v2
     assert t1 == t2 == 'v'
-    d3 = defaultdict(int)
-    for p1, n1 in d1.items():
-        for p2, n2 in d2.items():
-            d3[p1 + p2] += n1 * n2
-    return 'v', process(dict(d3))
+    if profiling.active is not None:
+        profiling.count('mul')
+        profiling.maximum('degree', d1.degree + d2.degree)
+    return 'v', process(d1 * d2)
 
 
 def process(p):
-    q = {}
-    for key, val in p.items():
-        if val and abs(val) > 1e-10:
-            q[key] = val
-    return q
+    coefficients = p.coefficients if isinstance(p, Polynomial) else Polynomial(p).coefficients
+    return Polynomial([val if val and abs(val) > 1e-10 else 0 for val in coefficients])
 
 
 def leading_term(p):
-    keys = list(process(p).keys())
-    if not keys: return 0, 0
-    key = max(keys)
-    return (key, p[key])
+    p = process(p)
+    if not p: return 0, 0
+    return p.degree, p.coefficients[-1]
 
 
 def division(p, q):
     '''
-    Computes the quotient and remainder of p/q
+    Computes the quotient and remainder of p/q through iterative long division over the
+    dense coefficient buffer, eliminating the leading term of the running remainder in place.
     :return: quotient, remainder
     '''
-    ltp = leading_term(p)
-    ltq = leading_term(q)
-    if not ltp[0] and not ltp[1]: return {}, ({}, {0 : 1})
-    if ltp[0] < ltq[0]:
-        return {}, (p, q)
-    lead = ltp[0] - ltq[0], ltp[1] / ltq[1]
-    _, fl = mul(('v', q), ('v', {lead[0] : lead[1]}))
-    _, rest = down_p(('+', [('v', p), ('-', ('v', fl))]))
-    quotient_, remainder = division(rest, q)
-    _, quotient = add(('v', {lead[0] : lead[1]}), ('v', quotient_))
-    return quotient, remainder
-
-
+    p, q = process(p), process(q)
+    if profiling.active is not None:
+        profiling.count('division')
+        profiling.maximum('degree', p.degree)
+    if not p: return Polynomial(), (Polynomial(), Polynomial([1]))
+    if p.degree < q.degree:
+        return Polynomial(), (p, q)
+    remainder = list(p.coefficients)
+    divisor = q.coefficients
+    quotient = [0] * (p.degree - q.degree + 1)
+    power = p.degree
+    while power >= q.degree:
+        coefficient = remainder[power]
+        if not coefficient:
+            power -= 1
+            continue
+        lead = coefficient / divisor[-1]
+        quotient[power - q.degree] += lead
+        shift = power - q.degree
+        for k, d in enumerate(divisor):
+            term = lead * d
+            if abs(term) <= 1e-10: continue
+            difference = remainder[shift + k] - term
+            # Keep the running remainder as clean as process() would leave it.
+            remainder[shift + k] = difference if abs(difference) > 1e-10 else 0
+        if remainder[power] and abs(lead * divisor[-1]) <= 1e-10:
+            # The leftover is below the resolution of the divisor, so it can never be eliminated.
+            remainder[power] = 0
+    remainder = process(remainder[:q.degree])
+    if not remainder: return process(quotient), (Polynomial(), Polynomial([1]))
+    return process(quotient), (remainder, q)
+
+
+@timed('gcd')
 def gcd(p, q):
     p = process(p)
     q = process(q)
-    if not q: return p
-    quotient, (remainder, _) = division(p, q)
-    return gcd(q, remainder)
+    while q:
+        quotient, (remainder, _) = division(p, q)
+        p, q = q, process(remainder)
+    return p
 
 
-def simplify(p, q):
+@timed('simplify')
+def simplify(p, q, exact = None):
+    '''
+    Reduces p/q into overflow(z) + top(z)/bottom(z), where the quotient is irreducible.
+    :param exact: whether to reduce exactly (see simplify_exactly) when p and q have exact coefficients, which
+                  defaults to exact_arithmetic. Otherwise, the gcd is found by Euclid's algorithm in floating point.
+    '''
+    if (exact_arithmetic if exact is None else exact) and rational(p) and rational(q):
+        return simplify_exactly(p, q)
     quotient, (remainder, _) = division(p, q)
     g = gcd(remainder, q)
 
@@ -214,6 +382,342 @@ def simplify(p, q):
     return quotient, (simplr[0], simplq[0])
 
 
+def rational(p):
+    return all(isinstance(c, (int, Fraction)) for c in Polynomial(p).coefficients)
+
+
+def ratio(a, b):
+    # Stays within the integers whenever the quotient is integral.
+    if isinstance(a, int) and isinstance(b, int) and not a % b:
+        return a // b
+    return Fraction(a) / b
+
+
+def divide_exactly(p, q):
+    '''
+    Long division of p by q over the rationals, without any of the rounding that division does.
+    Integer polynomials that divide evenly stay integer polynomials.
+    :return: quotient, remainder
+    '''
+    remainder = list(Polynomial(p).coefficients)
+    divisor = Polynomial(q).coefficients
+    if profiling.active is not None:
+        profiling.count('division')
+        profiling.maximum('degree', len(remainder) - 1)
+    if not divisor:
+        raise ZeroDivisionError('Polynomial division by zero')
+    if len(remainder) < len(divisor):
+        return Polynomial(), Polynomial(remainder)
+    quotient = [0] * (len(remainder) - len(divisor) + 1)
+    for shift in range(len(quotient) - 1, -1, -1):
+        lead = ratio(remainder[shift + len(divisor) - 1], divisor[-1])
+        if not lead: continue
+        quotient[shift] = lead
+        for k, d in enumerate(divisor):
+            remainder[shift + k] -= lead * d
+    return Polynomial(quotient), Polynomial(remainder[:len(divisor) - 1])
+
+
+@timed('simplify')
+def simplify_exactly(p, q):
+    '''
+    simplify for polynomials with exact (integer or rational) coefficients: reduces p/q by their
+    exact gcd and normalizes the denominator to q(0) = 1 (or to a monic one if q(0) = 0).
+    Coefficients that come out integral are returned as ints, and the rest as Fractions.
+    '''
+    quotient, remainder = divide_exactly(p, q)
+    g = gcd_integral(primitive(q), primitive(remainder))
+    top, bottom = divide_exactly(remainder, g)[0], divide_exactly(q, g)[0]
+    unit = ratio(1, bottom[0] if bottom[0] else bottom.coefficients[-1])
+    exact = lambda p: Polynomial([int(c) if c == int(c) else c for c in p.coefficients])
+    return exact(quotient), (exact(top.scale(unit)), exact(bottom.scale(unit)))
+
+
+def gcd_exactly(p, q):
+    '''
+    The monic gcd of two polynomials with exact coefficients.
+    '''
+    g = gcd_integral(primitive(p), primitive(q))
+    return g.scale(ratio(1, g.coefficients[-1])) if g else g
+
+
+def content(p):
+    '''
+    The gcd of the coefficients of an integer polynomial, with the sign of its leading coefficient.
+    '''
+    c = 0
+    for a in p.coefficients:
+        c = math.gcd(c, a)
+    return -c if p and p.coefficients[-1] < 0 else c
+
+
+def primitive(p):
+    '''
+    The primitive part of a polynomial with exact coefficients: the integer polynomial with coprime coefficients
+    and a positive leading coefficient that is a rational multiple of p.
+    '''
+    p = Polynomial(p)
+    denominators = [c.denominator for c in p.coefficients if isinstance(c, Fraction)]
+    if denominators:
+        scale = 1
+        for d in denominators:
+            scale = scale * d // math.gcd(scale, d)
+        p = Polynomial([int(c * scale) for c in p.coefficients])
+    c = content(p)
+    return Polynomial([a // c for a in p.coefficients]) if c else p
+
+
+def is_prime(n):
+    # Miller-Rabin over the bases 2, 3, 5 and 7 is exact for n < 3215031751.
+    if n < 2: return False
+    for b in (2, 3, 5, 7):
+        if n % b == 0: return n == b
+    d, s = n - 1, 0
+    while not d % 2:
+        d, s = d // 2, s + 1
+    for b in (2, 3, 5, 7):
+        x = pow(b, d, n)
+        if x in (1, n - 1): continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1: break
+        else:
+            return False
+    return True
+
+
+primes = []
+def nth_prime(i):
+    '''
+    The i-th largest prime below 2**31, which are the moduli of gcd_integral.
+    '''
+    while len(primes) <= i:
+        n = primes[-1] - 2 if primes else (1 << 31) - 1
+        while not is_prime(n):
+            n -= 2
+        primes.append(n)
+    return primes[i]
+
+
+def gcd_modulo(p, q, prime):
+    '''
+    The monic gcd of two polynomials (as coefficient lists) over the integers modulo prime, by Euclid's algorithm.
+    '''
+    def trim(p):
+        while p and not p[-1]:
+            p.pop()
+        return p
+    p, q = trim([a % prime for a in p]), trim([a % prime for a in q])
+    while q:
+        inverse = pow(q[-1], prime - 2, prime)
+        while len(p) >= len(q):
+            lead = p[-1] * inverse % prime
+            shift = len(p) - len(q)
+            for k, d in enumerate(q):
+                p[shift + k] = (p[shift + k] - lead * d) % prime
+            trim(p)
+        p, q = q, p
+    inverse = pow(p[-1], prime - 2, prime)
+    return [a * inverse % prime for a in p]
+
+
+@timed('gcd')
+def gcd_integral(p, q):
+    '''
+    The gcd of two primitive integer polynomials (see primitive), as a primitive integer polynomial, by Brown's
+    small primes modular algorithm. The gcd is computed modulo a sequence of word-sized primes, where its leading
+    coefficient is fixed to the gcd of the leading coefficients of p and q (which the true gcd divides), and the
+    images are stitched together by the Chinese remainder theorem until the result divides both p and q.
+    Unlike Euclid's algorithm over the rationals, no intermediate coefficient ever grows beyond the modulus.
+    '''
+    if not p or not q:
+        return primitive(p or q)
+    lead = math.gcd(p.coefficients[-1], q.coefficients[-1])
+    degree = min(p.degree, q.degree) + 1
+    residues, modulus, candidate = None, 1, None
+    i = 0
+    while True:
+        prime = nth_prime(i)
+        i += 1
+        if not lead % prime: continue
+        image = gcd_modulo(p.coefficients, q.coefficients, prime)
+        if len(image) == 1:
+            return Polynomial([1])
+        if len(image) - 1 > degree:
+            # An unlucky prime, which divides some resultant, and so has a gcd of too high a degree.
+            continue
+        image = [lead * a % prime for a in image]
+        if len(image) - 1 < degree:
+            # Every prime so far was unlucky, so start over.
+            degree, residues, modulus, candidate = len(image) - 1, image, prime, None
+        else:
+            # x = r (mod modulus) and x = a (mod prime)
+            inverse = pow(modulus, prime - 2, prime)
+            residues = [r + modulus * ((a - r) * inverse % prime) for r, a in zip(residues, image)]
+            modulus *= prime
+        # Read the residues in the symmetric range (-modulus/2, modulus/2].
+        previous, candidate = candidate, primitive(
+            Polynomial([r - modulus if 2 * r > modulus else r for r in residues]))
+        # Once the reconstruction stops changing, it is very likely right, so check it by exact division.
+        if candidate == previous and not divide_exactly(p, candidate)[1] and not divide_exactly(q, candidate)[1]:
+            return candidate
+
+
+def derivative(p):
+    return Polynomial([k * c for k, c in enumerate(p.coefficients)][1:])
+
+
+def square_free(p):
+    '''
+    Yun's square-free decomposition of a polynomial with exact coefficients.
+    :return: a list of (factor, multiplicity), where p is a constant times the product of every
+             factor ** multiplicity, and the factors are square-free, pairwise coprime and non-constant.
+    '''
+    # Over the integers, every division below is exact and stays integral.
+    p = primitive(p)
+    a = gcd_integral(p, primitive(derivative(p)))
+    b = divide_exactly(p, a)[0]
+    c = divide_exactly(derivative(p), a)[0]
+    d = c - derivative(b)
+    factors = []
+    multiplicity = 1
+    while b.degree > 0:
+        a = gcd_integral(primitive(b), primitive(d))
+        b = divide_exactly(b, a)[0]
+        c = divide_exactly(d, a)[0]
+        d = c - derivative(b)
+        if a.degree > 0:
+            factors.append((a, multiplicity))
+        multiplicity += 1
+    return factors
+
+
+cyclotomics = {}
+def cyclotomic(k):
+    '''
+    The k-th cyclotomic polynomial, whose roots are the primitive k-th roots of unity, as
+        z**k - 1 = product of cyclotomic(d) over the divisors d of k.
+    '''
+    if k not in cyclotomics:
+        p = Polynomial([-1] + [0] * (k - 1) + [1])
+        for d in range(1, k):
+            if not k % d:
+                p = divide_exactly(p, cyclotomic(d))[0]
+        cyclotomics[k] = p
+    return cyclotomics[k]
+
+
+@timed('factor')
+def factor(p):
+    '''
+    Factors a polynomial with exact coefficients into its square-free parts, and then splits every
+    cyclotomic factor (whose roots are all roots of unity, as in the (1 - z**k) that stars of words of
+    length k give) out of each part. Only the remaining factors have roots that are not known in closed form.
+    :return: (cyclotomic, rest), where cyclotomic is a list of (k, multiplicity) for each cyclotomic(k)
+             that divides p, and rest is a list of (factor, multiplicity) of what remains.
+    '''
+    cyclotomic_factors, rest = [], []
+    for g, multiplicity in square_free(p):
+        k = 1
+        # cyclotomic(k) has degree phi(k) >= sqrt(k / 2), but beyond a few times the degree of g, its
+        # roots are too crowded on the unit circle to be the roots of a small factor in practice.
+        while g.degree > 0 and k <= 4 * g.degree + 2:
+            quotient, remainder = divide_exactly(g, cyclotomic(k))
+            if not remainder:
+                cyclotomic_factors.append((k, multiplicity))
+                g = quotient
+            k += 1
+        if g.degree > 0:
+            rest.append((g, multiplicity))
+    return cyclotomic_factors, rest
+
+
+@timed('dfa elimination')
+def generating_function_from_dfa(dfa, what = None):
+    '''
+    Reads the generating function for the words accepted by a DFA straight off of its transfer
+    matrix A, without going back through a regex. Each x[i], the generating function for the
+    words accepted starting from state i, satisfies
+        x[i] = [i accepts] + sum of z x[j] over the transitions (i, j, c)
+    so that (I - zA) x = e, where e marks the accepting states. Since the automaton is deterministic,
+    every word is counted exactly once, no matter how ambiguous the original regex was.
+
+    The system is solved over the integer polynomials by fraction-free (Bareiss) Gaussian elimination,
+    so that every intermediate entry is exactly a minor of I - zA. The equations are eliminated in
+    the order that creates the fewest new entries (as in nfa.eliminate), and a row that the current
+    pivot does not touch is only rescaled once it is next needed, so each step only costs as much
+    as the entries it actually changes.
+    :param dfa: (start, final, dfa) as returned by nfa.determinize or nfa.minimize
+    :param what: the letters that contribute to the count, as in transfer
+    :return: overflow, (top, bottom) as in simplify
+    '''
+    start, final, transitions = dfa
+    index = {start: 0}
+    for (p, q, _) in transitions:
+        for state in (p, q):
+            if state not in index: index[state] = len(index)
+    n = len(index)
+    one, z = Polynomial([1]), Polynomial([0, 1])
+
+    # rows[i][j] is the coefficient of x[j] in the equation of state i, and rows[i][n] is its constant
+    rows = [{i: one} for i in range(n)]
+    for state, i in index.items():
+        if final in state: rows[i][n] = one
+    for (p, q, c) in transitions:
+        i, j = index[p], index[q]
+        rows[i][j] = rows[i].get(j, Polynomial()) - (z if not what or c in what else one)
+    # columns[j] is the set of (uneliminated) equations that mention x[j]
+    columns = [set() for _ in range(n)]
+    for i, row in enumerate(rows):
+        for j in list(row):
+            if not row[j]: del row[j]
+            elif j < n: columns[j].add(i)
+
+    # pivots[s] is the pivot of step s, which is also a principal minor of I - zA
+    pivots = [one]
+    stamp = [0] * n
+    def current(i):
+        # Had the pivots since step stamp[i] been applied to row i, they would have only rescaled it.
+        if stamp[i] < len(pivots) - 1:
+            for j, entry in rows[i].items():
+                rows[i][j] = divide_exactly(entry * pivots[-1], pivots[stamp[i]])[0]
+            stamp[i] = len(pivots) - 1
+        return rows[i]
+
+    remaining = set(range(1, n))
+    while remaining:
+        candidates = [k for k in remaining if k in rows[k]]
+        if not candidates:
+            raise ZeroDivisionError('I - zA is singular')
+        k = min(candidates, key=lambda k: ((len(rows[k]) - 1) * (len(columns[k]) - 1), k))
+        remaining.remove(k)
+        pivot_row = current(k)
+        pivot, previous = pivot_row.pop(k), pivots[-1]
+        for j in pivot_row:
+            if j < n: columns[j].discard(k)
+        for i in columns[k] - {k}:
+            row = current(i)
+            factor = row.pop(k)
+            for j in set(row) | set(pivot_row):
+                entry = pivot * row.get(j, Polynomial()) - factor * pivot_row.get(j, Polynomial())
+                entry = divide_exactly(entry, previous)[0]
+                if entry:
+                    row[j] = entry
+                    if j < n: columns[j].add(i)
+                else:
+                    row.pop(j, None)
+                    if j < n: columns[j].discard(i)
+            stamp[i] = len(pivots)
+        columns[k] = set()
+        rows[k] = None
+        pivots.append(pivot)
+
+    row = current(0)
+    if 0 not in row:
+        raise ZeroDivisionError('I - zA is singular')
+    return simplify_exactly(row.get(n, Polynomial()), row[0])
+
+
 def print_poly(p):
     p = process(p)
     if not p: return '0'
@@ -8,11 +8,14 @@ setup(name='regex_enumerate',
       author_email='lg342@cornell.edu',
       license='MIT',
       packages=['regex_enumerate'],
+      package_data={'regex_enumerate': ['data/oeis/*']},
       classifiers=[
           'Development Status :: 3 - Alpha',
           'License :: OSI Approved :: MIT License',
-          'Programming Language :: Python :: 2.7',
+          'Programming Language :: Python :: 3',
+          'Programming Language :: Python :: 3 :: Only',
       ],
+      python_requires='>=3.4',
       keywords='regular expression combinatorics',
       install_requires=[
           'scipy',
@@ -0,0 +1,34 @@
+import signal
+
+import pytest
+
+from regex_enumerate import constants, enumerate_batch, exact_many
+
+# The roots of 1 - z - z**2 - ... - z**40, more than constants.parallel_threshold of them.
+alternation = '(%s)*' % '|'.join('1' * j + '0' for j in range(40))
+
+
+def test_evaluate_identifies_many_roots_in_workers():
+    # Start from a cold memo, so that the workers have to identify every root themselves.
+    constants.clear()
+    [result] = enumerate_batch([alternation], [10, 50], method='evaluate', processes=2)
+    assert result.error is None
+    assert [round(value) for value in result.value] == exact_many(alternation, [10, 50])
+
+
+def test_dfa_rejects_what():
+    with pytest.raises(ValueError):
+        enumerate_batch(['(0|1)*'], [5], method='dfa', what='1')
+
+
+def test_inline_batch_restores_alarm_handler():
+    def handler(signum, frame):
+        pass
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    try:
+        results = list(enumerate_batch(['(0|1)*', '('], [5], processes=1, timeout=5))
+        assert [result.value for result in results] == [[32], None]
+        assert signal.getsignal(signal.SIGALRM) is handler
+    finally:
+        signal.signal(signal.SIGALRM, previous)
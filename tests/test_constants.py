@@ -0,0 +1,36 @@
+import json
+import multiprocessing
+
+from regex_enumerate import constants
+
+
+def save_many(arguments):
+    path, j = arguments
+    constants.store = path
+    for i in range(20):
+        constants.clear()
+        constants.remember('%d-%d' % (j, i), lambda: i)
+        constants.save()
+
+
+def test_concurrent_saves_keep_every_constant(tmp_path):
+    path = str(tmp_path / 'constants.json')
+    pool = multiprocessing.Pool(4)
+    try:
+        pool.map(save_many, [(path, j) for j in range(8)])
+    finally:
+        pool.close()
+        pool.join()
+    with open(path) as f:
+        assert len(json.load(f)) == 8 * 20
+
+
+def test_memo_is_bounded(monkeypatch):
+    monkeypatch.setattr(constants.memo, 'maxsize', 4)
+    try:
+        for i in range(10):
+            assert constants.remember('key %d' % i, lambda: None) is None
+        assert len(constants.memo) == 4
+        assert constants.identify_many([0.5, 0.5, 0.25], 1e-6, 10, processes=1) == ['(1/2)', '(1/2)', '(1/4)']
+    finally:
+        constants.clear()
@@ -0,0 +1,18 @@
+from itertools import islice
+
+from regex_enumerate import enumerate_coefficients, evaluate_many, exact_many
+
+# The roots of 1 - z - z**2 - ... - z**40, whose counts grow exponentially.
+alternation = '(%s)*' % '|'.join('1' * j + '0' for j in range(40))
+
+
+def test_evaluate_many_stays_real_as_counts_grow():
+    ns = [94, 115, 200]
+    for precision in [None, 30]:
+        for value, count in zip(evaluate_many(alternation, ns, precision=precision), exact_many(alternation, ns)):
+            assert abs(float(value) - count) <= 1e-9 * count
+
+
+def test_enumerate_coefficients_stays_real_as_counts_grow():
+    values = list(islice(enumerate_coefficients(alternation), 201))
+    assert abs(values[200] - exact_many(alternation, [200])[0]) <= 1e-9 * values[200]
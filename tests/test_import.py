@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+probe = '''
+import sys, time
+start = time.time()
+import regex_enumerate
+regex_enumerate.exact('(0+1)*0+', 100)
+print('%f %s' % (time.time() - start, ' '.join(m for m in ('numpy', 'scipy', 'sympy', 'mpmath') if m in sys.modules)))
+'''
+
+
+def test_import_is_light():
+    # Importing the library (and counting exactly) must not pull in any of the heavy numeric dependencies,
+    # which is only measurable in a fresh interpreter.
+    budget = 0.25
+    output = subprocess.check_output([sys.executable, '-c', probe], cwd=root, universal_newlines=True).split()
+    elapsed, loaded = float(output[0]), output[1:]
+    assert loaded == []
+    assert elapsed <= budget, 'Imported and counted in %.3fs, over the budget of %.2fs.' % (elapsed, budget)
@@ -0,0 +1,97 @@
+import sys
+import threading
+
+from regex_enumerate import cache_clear, exact, exact_many
+from regex_enumerate.compiled import cache as compile_cache, compile
+from regex_enumerate.enumerate import jumper, linear_recurrence
+from regex_enumerate.memoize import LRUCache
+
+
+def hammer(target, threads = 8):
+    errors = []
+    barrier = threading.Barrier(threads)
+    # Switch between threads as often as possible, to widen every window for a race.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def work(j):
+        try:
+            barrier.wait()
+            target(j)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=work, args=(j,)) for j in range(threads)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+    sys.setswitchinterval(interval)
+    return errors
+
+
+def test_cache_is_thread_safe():
+    cache = LRUCache(maxsize = 8, maxweight = 64, weigh = lambda value: value % 16)
+
+    def target(j):
+        for i in range(20000):
+            key = (i * 7 + j) % 32
+            if cache.get(key) is None: cache.put(key, key)
+            if i % 1000 == 0:
+                cache.evict()
+                cache.info()
+
+    assert hammer(target) == []
+    assert len(cache) <= 8
+    assert cache.weight == sum(key % 16 for key in cache.entries)
+
+
+def test_exact_is_thread_safe_under_eviction():
+    maxsize = compile_cache.maxsize
+    compile_cache.maxsize = 8
+    try:
+        patterns = ['(%s|%s)*' % ('0' * (k % 5 + 1), '1' * (k % 7 + 1)) for k in range(32)]
+        expected = [exact(pattern, 30) for pattern in patterns]
+
+        def target(j):
+            for _ in range(5):
+                for k in range(len(patterns)):
+                    pattern = patterns[(k + j) % len(patterns)]
+                    assert exact(pattern, 30) == expected[(k + j) % len(patterns)]
+
+        assert hammer(target) == []
+    finally:
+        compile_cache.maxsize = maxsize
+        compile_cache.clear()
+
+
+pattern = '1*(22)*(333)*(4444)*(55555)*(666666)*(7777777)*'
+ns = [10 ** 6 + j for j in range(8)]
+
+
+def test_exact_is_thread_safe_on_a_shared_regex():
+    # Every thread jumps far out on the same freshly compiled regex, so they all race to compute its stages and
+    # to extend its table of squarings.
+    cache_clear()
+    expected = exact_many(pattern, ns)
+    for _ in range(10):
+        cache_clear()
+        results = [None] * len(ns)
+
+        def target(j):
+            results[j] = exact(pattern, ns[j])
+
+        assert hammer(target) == []
+        assert results == expected
+
+
+def test_jumper_is_thread_safe():
+    overflow, top, recurrence = linear_recurrence(compile(pattern))
+    expected = exact_many(pattern, ns)
+    for _ in range(10):
+        jump = jumper(top, recurrence)
+        results = [None] * len(ns)
+
+        def target(j):
+            results[j] = int(round(jump(ns[j]) + overflow.get(ns[j], 0)))
+
+        assert hammer(target) == []
+        assert results == expected
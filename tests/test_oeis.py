@@ -0,0 +1,38 @@
+import os
+import shutil
+
+import pytest
+
+from regex_enumerate import check_on_oeis
+from regex_enumerate.oeis import fixture, open_index
+
+
+@pytest.fixture(scope='module')
+def index(tmp_path_factory):
+    # open_index builds the index next to the raw dumps, so build it out of a copy of the fixture.
+    directory = str(tmp_path_factory.mktemp('oeis'))
+    for name in ('stripped', 'names'):
+        shutil.copy(os.path.join(fixture, name), directory)
+    return open_index(directory)
+
+
+def test_lookup_fibonacci(index):
+    [sequence] = index.lookup_by_terms([13, 21, 34, 55, 89, 144])
+    assert sequence.id == 'A000045' and sequence.position == 7
+    assert sequence.name.startswith('Fibonacci numbers')
+
+
+def test_lookup_partitions(index):
+    ids = [sequence.id for sequence in check_on_oeis('1*(22)*(333)*(4444)*(55555)*', start=5, index=index)]
+    assert 'A001401' in ids
+    assert index.lookup_by_terms([1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048 + 1]) == []
+
+
+def test_reopen_built_index(index):
+    assert open_index(index.directory) is index
+    assert [s.id for s in check_on_oeis('(00*1)*', start=5, index=index.directory)] == ['A000045']
+
+
+def test_lookup_far_out(index):
+    # The counts from start on are jumped to, rather than stepped through.
+    assert check_on_oeis('(0|1)*', start=10 ** 7, index=index) == []
@@ -0,0 +1,46 @@
+import os
+from fractions import Fraction
+
+import pytest
+
+from regex_enumerate import persistent
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(persistent, 'maxbytes', persistent.maxbytes)
+    persistent.use(str(tmp_path))
+    yield str(tmp_path)
+    persistent.use(None)
+
+
+def test_round_trip(cache):
+    fields = {'small': [1, -2, 3], 'large': [1 << 70, Fraction(1, 3)], 'real': [0.5], 'complex': [1j], 'empty': []}
+    assert persistent.fetch(persistent.key('entry'), lambda: fields) == fields
+    assert persistent.fetch(persistent.key('entry'), lambda: None) == fields
+
+
+def test_writes_only_scan_once_over_budget(cache, monkeypatch):
+    scans = []
+    evict = persistent.evict
+    monkeypatch.setattr(persistent, 'evict', lambda: scans.append(1) or evict())
+    for i in range(20):
+        persistent.fetch(persistent.key('entry', i), lambda: {'values': list(range(100))})
+    assert len(scans) == 1
+    persistent.maxbytes = persistent.estimate
+    persistent.fetch(persistent.key('entry', 20), lambda: {'values': list(range(100))})
+    assert len(scans) == 2 and persistent.estimate <= persistent.maxbytes
+
+
+def test_evict_skips_temporary_files(cache):
+    for i in range(20):
+        persistent.fetch(persistent.key('entry', i), lambda: {'values': list(range(100))})
+    folder = os.path.join(cache, sorted(os.listdir(cache))[0])
+    temporary = os.path.join(folder, 'pending.tmp')
+    with open(temporary, 'wb') as f:
+        f.write(b'\0' * 4096)
+    os.utime(temporary, (0, 0))
+    persistent.maxbytes = 1
+    persistent.evict()
+    assert os.path.exists(temporary)
+    assert [name for name in os.listdir(folder)] == ['pending.tmp']
@@ -0,0 +1,26 @@
+from itertools import islice
+
+from regex_enumerate import coefficients_array, exact_coefficients
+from regex_enumerate.series import to_int
+
+
+def counts(array):
+    return [to_int(row) for row in array] if array.ndim == 2 else [int(count) for count in array]
+
+
+def test_polynomial_growth_through_transforms():
+    regex = '1*(22)*(333)*(4444)*(55555)*'
+    assert counts(coefficients_array(regex, 5000)) == list(islice(exact_coefficients(regex), 5000))
+
+
+def test_exponential_growth_through_the_recurrence():
+    # The counts take thousands of bits, far more than the transforms have primes for.
+    regex = '(0|1)*'
+    assert counts(coefficients_array(regex, 20000, block=4096)) == [2 ** n for n in range(20000)]
+
+
+def test_modular():
+    regex = '(0+1)*0+'
+    modulus = 10 ** 9 + 7
+    expected = [count % modulus for count in islice(exact_coefficients(regex), 1000)]
+    assert [int(count) for count in coefficients_array(regex, 1000, modulus=modulus)] == expected
@@ -0,0 +1,40 @@
+from itertools import islice
+
+import pytest
+
+from regex_enumerate import cache_clear, dfa_coefficients, exact, exact_coefficients, is_unambiguous, profile
+from regex_enumerate.parse import parse
+from regex_enumerate.transfer import Polynomial, divide_exactly, rationalize, simplify, transfer
+
+
+def test_divide_exactly():
+    quotient, remainder = divide_exactly(Polynomial([-1, 0, 1]), Polynomial([1, 1]))
+    assert quotient.coefficients == [-1, 1] and not remainder
+
+
+def test_divide_exactly_by_zero():
+    with pytest.raises(ZeroDivisionError):
+        divide_exactly(Polynomial([1, 1]), Polynomial())
+    with pytest.raises(ZeroDivisionError):
+        exact('((%)+)+', 3)
+
+
+def test_exact_divisions_are_profiled():
+    cache_clear()
+    with profile() as report:
+        exact('(0+1)*0+', 10)
+    assert report.counts['division'] > 0
+
+
+def test_sums_share_the_lcm_of_their_denominators():
+    # The denominators 1 - z**k have a product of degree 1770, but an lcm of degree 1086.
+    regex = '|'.join('(%s)*' % ('1' * k) for k in range(1, 60))
+    p, q = rationalize(transfer(parse(regex)))
+    overflow, (top, bottom) = simplify(p, q)
+    assert q.degree == bottom.degree == 1086
+
+
+def test_sums_over_distinct_denominators():
+    for regex in ['(00)*|(0000)*1', '(00)*1|(0000)*11|(000)*111|(0|10)*2', '(000)*2|(00)*1|(0|11)*3']:
+        assert is_unambiguous(regex)
+        assert list(islice(exact_coefficients(regex), 40)) == list(dfa_coefficients(regex, 39))